@@ -0,0 +1,283 @@
+"""
+End-to-end load benchmark of the API against the local TMDB stub.
+
+Every route registered by `MoviesAPI._create_api` is driven at each concurrency level, reporting the p50/p95/p99
+latency, the throughput and the number of upstream calls per request. Run it from the `api` directory:
+
+    python -m benchmarks.run --levels 1,8,32 --requests 200 --latency 50 --output bench.json
+
+Pass `--baseline bench.json` to compare against an earlier run, the exit status is 1 when the p95 latency of a route
+regressed by more than `--tolerance`.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import requests
+
+from .tmdb_stub import TMDBStub
+
+# Path params of the routes.
+ACCOUNT_ID = 548
+TOP_MOVIES_AMOUNT = 100
+SESSION_ID = '79191836ddaa0da3df76a5ffef6f07ad6ab0c641'
+# Deleted movies are taken from a range outside the movies requested by the other routes.
+DELETED_MOVIE_IDS = itertools.count(90000)
+# Hash and movie ids of the chart linked by `/api/movie/average-scores`, see `link_chart`.
+CHART: Dict[str, str] = {}
+
+# Query args and JSON bodies of the routes that need them, by (rule, method).
+QUERIES: Dict[Tuple[str, str], Callable[[Callable[[], int]], dict]] = {
+    ('/api/movie/average-scores', 'GET'): lambda movie: {'movie_ids': ','.join(str(movie()) for _ in range(10))},
+    ('/api/movie/average-scores/chart/<string:chart_hash>', 'GET'): lambda movie: {'movie_ids': CHART['movie_ids']},
+    ('/api/movie/batch', 'GET'): lambda movie: {'movie_ids': ','.join(str(movie()) for _ in range(10))},
+    ('/api/account/', 'GET'): lambda movie: {'session_id': SESSION_ID},
+    ('/api/account/<int:account_id>/favorite', 'POST'): lambda movie: {'session_id': SESSION_ID},
+    ('/api/account/<int:account_id>/favorite/movies', 'GET'): lambda movie: {'session_id': SESSION_ID},
+}
+BODIES: Dict[Tuple[str, str], Callable[[Callable[[], int]], dict]] = {
+    ('/api/authentication/session', 'POST'): lambda movie: {'request_token': 'ff5c7eeb5a8870efe3cd7fc5c282cffd26800ecd'},
+    ('/api/authentication/session', 'DELETE'): lambda movie: {'session_id': SESSION_ID},
+    ('/api/account/<int:account_id>/favorite', 'POST'): lambda movie: {
+        'media_type': 'movie', 'media_id': movie(), 'favorite': True,
+    },
+}
+# Routes that aren't part of the API itself.
+EXCLUDED_ENDPOINTS = {'api.specs', 'api.doc', 'api.root'}
+
+
+class Scenario:
+    """
+    Requests against a single route and method.
+    """
+
+    def __init__(self, rule, method: str, movies: int):
+        self.rule = rule.rule
+        self.method = method
+        self.name = f'{method} {rule.rule}'
+        self.arguments = sorted(rule.arguments)
+        self.movies = movies
+
+    def movie(self) -> int:
+        return random.randint(1, self.movies)
+
+    def path_value(self, argument: str) -> Union[int, str]:
+        if argument == 'movie_id':
+            return next(DELETED_MOVIE_IDS) if self.method == 'DELETE' else self.movie()
+        if argument == 'amount':
+            return TOP_MOVIES_AMOUNT
+        if argument == 'account_id':
+            return ACCOUNT_ID
+        if argument == 'chart_hash':
+            return CHART['chart_hash']
+        raise ValueError(f'No value for path param {argument} of {self.rule}.')
+
+    def request(self) -> dict:
+        """
+        Build the arguments of a random request against the route.
+        """
+        path = self.rule
+        for argument in self.arguments:
+            path = re.sub(rf'<(?:\w+:)?{argument}>', str(self.path_value(argument)), path)
+        key = (self.rule, self.method)
+        return {
+            'method': self.method,
+            'path': path,
+            'params': QUERIES[key](self.movie) if key in QUERIES else None,
+            'json': BODIES[key](self.movie) if key in BODIES else None,
+        }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def drive(base_url: str, scenario: Scenario, stub: TMDBStub, concurrency: int, total: int) -> dict:
+    """
+    Send `total` requests of a scenario with `concurrency` concurrent clients.
+
+    :return: The latency percentiles in milliseconds, the throughput, the error count and the upstream calls per
+        request.
+    """
+    local = threading.local()
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(_):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        request = scenario.request()
+        start = time.perf_counter()
+        response = session.request(request['method'], base_url + request['path'], params=request['params'],
+                                   json=request['json'])
+        # Include reading a streamed body.
+        _ = response.content
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code >= 500:
+                errors += 1
+
+    stub.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(total)))
+    duration = time.perf_counter() - start
+    upstream_calls = stub.stats()['calls']
+
+    return {
+        'route': scenario.name,
+        'concurrency': concurrency,
+        'requests': total,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(total / duration, 1),
+        'errors': errors,
+        'upstream_calls_per_request': round(upstream_calls / total, 2),
+    }
+
+
+def create_server(stub: TMDBStub, mode: str):
+    """
+    Create the API the way `manage.py` does, talking to the stub, and serve it on a free port.
+
+    :return: The server and its base url.
+    """
+    os.environ['TMDB_BASE_URL'] = stub.url
+    os.environ.setdefault('THEMOVIEDB_API_KEY', 'benchmark')
+    # Don't touch the state of a local installation.
+    state = tempfile.mkdtemp(prefix='movies-api-benchmark-')
+    os.environ.setdefault('CACHE_SQLITE_PATH', os.path.join(state, 'cache.sqlite3'))
+    os.environ.setdefault('DELETED_MOVIES_PATH', os.path.join(state, 'deleted_movies.sqlite3'))
+    os.environ.setdefault('MIRROR_PATH', os.path.join(state, 'mirror.sqlite3'))
+    os.environ.setdefault('TMDB_RATE_LIMIT_PATH', os.path.join(state, 'rate_limit.sqlite3'))
+    # The stub has no rate limit, the benchmark measures the API rather than the budget of the governor.
+    os.environ.setdefault('TMDB_RATE_LIMIT', '0')
+    # Background sweeps and the warm-up would add upstream calls that no request made.
+    os.environ.setdefault('MIRROR_SYNC', '0')
+    os.environ.setdefault('WARMUP', '0')
+
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import manage
+    from main import create_app
+
+    movies_api = manage.MoviesAPI()
+    app = create_app(mode)
+    app.register_blueprint(manage.blueprint)
+    # Keep the request log out of the report.
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='api', daemon=True).start()
+    return server, app, movies_api, f'http://127.0.0.1:{server.server_port}'
+
+
+def link_chart(base_url: str, movies: int):
+    """
+    Compare the average scores of the first movies for a real chart, requested by the scenario of the chart route.
+    """
+    movie_ids = ','.join(str(movie_id) for movie_id in range(1, min(movies, 10) + 1))
+    response = requests.get(base_url + '/api/movie/average-scores', params={'movie_ids': movie_ids})
+    response.raise_for_status()
+    url = urllib.parse.urlsplit(response.json()['data']['chart'])
+    CHART['chart_hash'] = url.path.rsplit('/', 1)[-1]
+    CHART['movie_ids'] = urllib.parse.parse_qs(url.query)['movie_ids'][0]
+
+
+def scenarios(app, movies: int, routes: Optional[str]) -> List[Scenario]:
+    """
+    Create a scenario for every route and method of the API.
+    """
+    result = []
+    for rule in app.url_map.iter_rules():
+        if not rule.endpoint.startswith('api.') or rule.endpoint in EXCLUDED_ENDPOINTS:
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            scenario = Scenario(rule, method, movies)
+            if routes is None or re.search(routes, scenario.name):
+                result.append(scenario)
+    return result
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """
+    Find the routes whose p95 latency regressed by more than `tolerance` compared to the baseline.
+    """
+    previous = {(entry['route'], entry['concurrency']): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['route'], entry['concurrency']))
+        if before and entry['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{entry['route']} @ {entry['concurrency']}: p95 {before['p95_ms']} ms -> "
+                               f"{entry['p95_ms']} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark of the Movies API.')
+    parser.add_argument('--mode', choices=['dev', 'prod'], default='prod')
+    parser.add_argument('--levels', default='1,8,32', help='Comma separated concurrency levels.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route and concurrency level.')
+    parser.add_argument('--movies', type=int, default=200, help='Number of distinct movies requested.')
+    parser.add_argument('--routes', help='Only benchmark the routes matching this regular expression.')
+    parser.add_argument('--latency', type=float, default=50.0, help='Mean upstream latency in milliseconds.')
+    parser.add_argument('--jitter', type=float, default=10.0, help='Maximum upstream latency deviation in ms.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream 503 responses.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of upstream 429 responses.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare the results with the JSON results of an earlier run.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative p95 regression.')
+    args = parser.parse_args()
+
+    stub = TMDBStub(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+                    rate_limit_rate=args.rate_limit_rate).start()
+    server, app, _, base_url = create_server(stub, args.mode)
+    link_chart(base_url, args.movies)
+
+    results = []
+    header = f"{'route':<55} {'conc':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'err':>5} {'up/req':>7}"
+    print(header)
+    print('-' * len(header))
+    for concurrency in (int(level) for level in args.levels.split(',')):
+        for scenario in scenarios(app, args.movies, args.routes):
+            entry = drive(base_url, scenario, stub, concurrency, args.requests)
+            results.append(entry)
+            print(f"{entry['route']:<55} {concurrency:>5} {entry['p50_ms']:>9} {entry['p95_ms']:>9} "
+                  f"{entry['p99_ms']:>9} {entry['throughput_rps']:>8} {entry['errors']:>5} "
+                  f"{entry['upstream_calls_per_request']:>7}")
+
+    server.shutdown()
+    stub.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Local stand-in for The Movie Database API, serving recorded fixtures with configurable latency and error rates.
+
+Run it standalone with `python -m benchmarks.tmdb_stub --port 8765 --latency 50` from the `api` directory and point the
+API at it with `TMDB_BASE_URL=http://localhost:8765/3`.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_SIZE = 20
+TOTAL_PAGES = 500
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES, f'{name}.json')) as f:
+        return json.load(f)
+
+
+class Fixtures:
+    """
+    The recorded fixtures, expanded to any movie id and page number so fan-out endpoints see distinct movies.
+    """
+
+    def __init__(self, max_movie_id: int):
+        self.max_movie_id = max_movie_id
+        self.movie = load_fixture('movie')
+        self.credits = load_fixture('movie_credits')
+        self.page = load_fixture('movie_list_page')
+        self.genres = load_fixture('genre_movie_list')
+        self.static = {
+            name: load_fixture(name) for name in (
+                'account', 'account_favorite', 'authentication_token_new', 'authentication_session_new',
+                'authentication_session_delete', 'not_found', 'invalid_session',
+            )
+        }
+
+    def movie_details(self, movie_id: int) -> Optional[dict]:
+        if not 0 < movie_id <= self.max_movie_id:
+            return None
+        movie = copy.deepcopy(self.movie)
+        all_genres = self.genres['genres']
+        movie.update(
+            id=movie_id,
+            title=f"{self.movie['title']} {movie_id}",
+            original_title=f"{self.movie['original_title']} {movie_id}",
+            runtime=80 + movie_id % 80,
+            popularity=round(10000 / movie_id, 3),
+            vote_average=round(5 + (movie_id % 50) / 10, 1),
+            genres=[all_genres[(movie_id + k) % len(all_genres)] for k in range(1 + movie_id % 3)],
+        )
+        return movie
+
+    def movie_credits(self, movie_id: int) -> Optional[dict]:
+        if not 0 < movie_id <= self.max_movie_id:
+            return None
+        credits = copy.deepcopy(self.credits)
+        credits['id'] = movie_id
+        for member in credits['cast']:
+            # Actors play in a band of neighbouring movies, so casts overlap.
+            member['id'] = member['id'] * 1000 + movie_id // 10
+        return credits
+
+    def movie_page(self, page: int, seed: int = 0) -> dict:
+        body = copy.deepcopy(self.page)
+        body['page'] = page
+        body['total_pages'] = TOTAL_PAGES
+        body['total_results'] = TOTAL_PAGES * PAGE_SIZE
+        for index, movie in enumerate(body['results']):
+            movie_id = ((page - 1) * PAGE_SIZE + index + seed) % self.max_movie_id + 1
+            movie['id'] = movie_id
+            movie['popularity'] = round(10000 / movie_id, 3)
+        return body
+
+
+class TMDBStub:
+    """
+    Threaded HTTP server imitating the endpoints of The Movie Database used by the API.
+
+    :param port: The port to listen on, 0 picks a free port.
+    :param latency: Mean latency in seconds added to every response.
+    :param jitter: Maximum random deviation in seconds from the mean latency.
+    :param error_rate: Fraction of the responses that fail with a 503.
+    :param rate_limit_rate: Fraction of the responses that fail with a 429 and a `Retry-After` header.
+    :param max_movie_id: Highest movie id that exists, higher ids are not found.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, max_movie_id: int = 100000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.fixtures = Fixtures(max_movie_id)
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        The base url of the stub, to be used as `TMDB_BASE_URL`.
+        """
+        return f'http://127.0.0.1:{self.server.server_address[1]}/3'
+
+    def start(self) -> 'TMDBStub':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='tmdb-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the number of upstream calls, in total and per route.
+        """
+        with self._lock:
+            return {'calls': sum(self.calls.values()), 'routes': dict(self.calls)}
+
+    def _record(self, route: str):
+        with self._lock:
+            self.calls[route] += 1
+
+    def respond(self, method: str, path: str, query: dict) -> Tuple[int, dict, dict]:
+        """
+        Build the response of an upstream call.
+
+        :param method: The HTTP method.
+        :param path: The path relative to the API version root.
+        :param query: The parsed query params.
+        :return: The status code, headers and body of the response.
+        """
+        fixtures = self.fixtures
+        page = int(query.get('page', ['1'])[0])
+
+        if method == 'GET':
+            match = re.fullmatch(r'/movie/(\d+)', path)
+            if match:
+                self._record('/movie/{id}')
+                movie = fixtures.movie_details(int(match[1]))
+                if movie is None:
+                    return 404, {}, fixtures.static['not_found']
+                if 'credits' in query.get('append_to_response', [''])[0].split(','):
+                    movie['credits'] = fixtures.movie_credits(movie['id'])
+                return 200, {}, movie
+            match = re.fullmatch(r'/movie/(\d+)/credits', path)
+            if match:
+                self._record('/movie/{id}/credits')
+                credits = fixtures.movie_credits(int(match[1]))
+                return (200, {}, credits) if credits else (404, {}, fixtures.static['not_found'])
+            if path == '/movie/popular':
+                self._record(path)
+                return 200, {}, fixtures.movie_page(page)
+            if path == '/discover/movie':
+                self._record(path)
+                # Different filters discover different movies.
+                filters = sorted((key, tuple(value)) for key, value in query.items() if key != 'page')
+                return 200, {}, fixtures.movie_page(page, seed=zlib.crc32(repr(filters).encode()) % 997)
+            if path == '/genre/movie/list':
+                self._record(path)
+                return 200, {}, fixtures.genres
+            if path == '/authentication/token/new':
+                self._record(path)
+                return 200, {}, fixtures.static['authentication_token_new']
+            if path == '/account':
+                self._record(path)
+                if 'session_id' not in query:
+                    return 401, {}, fixtures.static['invalid_session']
+                return 200, {}, fixtures.static['account']
+            if re.fullmatch(r'/account/\d+/favorite/movies', path):
+                self._record('/account/{id}/favorite/movies')
+                if 'session_id' not in query:
+                    return 401, {}, fixtures.static['invalid_session']
+                return 200, {}, fixtures.movie_page(page, seed=5000)
+        elif method == 'POST':
+            if path == '/authentication/session/new':
+                self._record(path)
+                return 200, {}, fixtures.static['authentication_session_new']
+            if re.fullmatch(r'/account/\d+/favorite', path):
+                self._record('/account/{id}/favorite')
+                return 201, {}, fixtures.static['account_favorite']
+        elif method == 'DELETE':
+            if path == '/authentication/session':
+                self._record(path)
+                return 200, {}, fixtures.static['authentication_session_delete']
+        self._record('unknown')
+        return 404, {}, fixtures.static['not_found']
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, don't let Nagle delay the body.
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+
+                if url.path == '/__stats__':
+                    return self._send(200, {}, stub.stats())
+                if url.path == '/__reset__':
+                    stub.reset()
+                    return self._send(200, {}, {'success': True})
+
+                delay = stub.latency + random.uniform(-stub.jitter, stub.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                draw = random.random()
+                if draw < stub.rate_limit_rate:
+                    return self._send(429, {'Retry-After': '1'}, {'status_code': 25, 'status_message': 'Limited.'})
+                if draw < stub.rate_limit_rate + stub.error_rate:
+                    return self._send(503, {}, {'status_code': 43, 'status_message': 'Unavailable.'})
+
+                path = url.path[len('/3'):] if url.path.startswith('/3/') else url.path
+                status, headers, body = stub.respond(self.command, path, parse_qs(url.query))
+                data = json.dumps(body).encode()
+                if self.command == 'GET' and status == 200:
+                    # Like TMDB, successful responses carry a weak ETag and can be revalidated.
+                    headers['ETag'] = f'W/"{zlib.crc32(data):08x}"'
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        self.send_response(304)
+                        self.send_header('ETag', headers['ETag'])
+                        return self.end_headers()
+                self._send(status, headers, data)
+
+            def _send(self, status: int, headers: dict, body: Union[dict, bytes]):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json;charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = _handle
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for The Movie Database API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean latency in milliseconds.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum latency deviation in milliseconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 503 responses.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of 429 responses.')
+    args = parser.parse_args()
+
+    stub = TMDBStub(args.port, args.latency / 1000, args.jitter / 1000, args.error_rate, args.rate_limit_rate)
+    print(f'Serving The Movie Database stub at {stub.url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,51 @@ from flask import Flask
 from flask_cors import CORS
 
 from .config import config_by_name
+from .service import mirror_service
+from .service.chart_service import charts
+from .service.genre_service import genres
+from .service.session_cache import session_cache
+from .service.tmdb_service import tmdb
+from .service.warmup import warmup
+from .util import conditional, metrics
+from .util.compression import compressor
+from .util.decoratorMovies import deletedMovies
 
 
-def create_app(config_name: str) -> Flask:
+def create_app(config_name: str, background: bool = True) -> Flask:
     """
     Factory function that creates a new Flask application instance with the given configuration.
 
     :param config_name: The name of the configuration to use.
     :type config_name: str
+    :param background: Whether to start the enabled background jobs, i.e. the warm-up and the mirror sync. One-off
+        commands run the jobs themselves and exit when done.
+    :type background: bool
     :return: A new Flask application instance.
     """
     app = Flask(__name__, static_folder='../../build', static_url_path='/')
     # configure the application using the specified configuration
     app.config.from_object(config_by_name[config_name])
+    if not background:
+        app.config.update(WARMUP=False, MIRROR_SYNC=False)
     # enable CORS support for the application
     cors = CORS(app, origins=["*"], supports_credentials=True)
+    # configure the shared client for The Movie Database
+    tmdb.init_app(app)
+    genres.init_app(app)
+    # cache the account responses of every session
+    session_cache.init_app(app)
+    charts.init_app(app)
+    # replay the deleted movies
+    deletedMovies.init_app(app)
+    # open the local mirror of the movie metadata and start syncing it
+    mirror_service.init_app(app)
+    # warm the caches in the background once everything they depend on is configured
+    warmup.init_app(app)
+    # trace the requests and expose their metrics
+    metrics.init_app(app)
+    # compress the responses once they are final
+    compressor.init_app(app)
+    # answer repeated requests with 304 Not Modified, registered last so the metrics record the final status
+    conditional.init_app(app)
     return app
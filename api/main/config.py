@@ -10,6 +10,111 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'my_precious_secret_key')
     DEBUG = False
     THEMOVIEDB_API_KEY = os.environ.get('THEMOVIEDB_API_KEY')
+    # The Movie Database upstream settings.
+    TMDB_BASE_URL = os.getenv('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+    TMDB_LANGUAGE = 'en-US'
+    # Size of the keep-alive connection pool of each worker.
+    TMDB_POOL_SIZE = int(os.getenv('TMDB_POOL_SIZE', 10))
+    # (connect, read) timeout in seconds of each upstream call.
+    TMDB_TIMEOUT = (3.05, 10)
+    TMDB_RETRIES = 3
+    TMDB_BACKOFF_FACTOR = 0.3
+    # Number of concurrent upstream calls of a single fan-out request, e.g. `/movie/average-scores`.
+    TMDB_FANOUT_WORKERS = int(os.getenv('TMDB_FANOUT_WORKERS', 10))
+    # Rate limit of the upstream calls in calls per second (0 disables it) and the size of a burst. 'memory' gives
+    # every worker its own budget, 'sqlite' shares one budget between the workers on the same host.
+    TMDB_RATE_LIMIT = float(os.getenv('TMDB_RATE_LIMIT', 40))
+    TMDB_RATE_BURST = int(os.getenv('TMDB_RATE_BURST', 40))
+    TMDB_RATE_LIMIT_BACKEND = os.getenv('TMDB_RATE_LIMIT_BACKEND', 'memory')
+    TMDB_RATE_LIMIT_PATH = os.getenv('TMDB_RATE_LIMIT_PATH',
+                                     os.path.join(basedir, '..', 'instance', 'rate_limit.sqlite3'))
+    # Per lane (interactive, fan-out, background): the share of the burst left for the higher lanes and the number of
+    # seconds a call may wait for the rate limit before it is given up.
+    TMDB_RATE_RESERVES = (0, 0.1, 0.5)
+    TMDB_RATE_DEADLINES = (2, 5, 60)
+    # Response cache of the upstream calls, a list of (path pattern, ttl, stale window) in seconds. Expired entries
+    # are still served during their stale window while being refreshed in the background. Movie details aren't cached
+    # here, they are kept in the mirror.
+    TMDB_CACHE_POLICIES = [
+        (r'discover/movie', 10 * 60, 60 * 60),
+    ]
+    # Cache of the upstream responses of a user session, a list of (path pattern, ttl) in seconds. All entries of a
+    # session are dropped when it changes its favorites or logs out.
+    SESSION_CACHE_POLICIES = [
+        (r'account', 60),
+        (r'account/\d+/favorite/movies', 30),
+    ]
+    SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', 10000))
+    SESSION_CACHE_MAX_BYTES = int(os.getenv('SESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    TMDB_CACHE_MAX_ENTRIES = int(os.getenv('TMDB_CACHE_MAX_ENTRIES', 10000))
+    TMDB_CACHE_MAX_BYTES = int(os.getenv('TMDB_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+    # Storage of the response, session and chart caches: 'memory' keeps a copy per worker, 'sqlite' shares one file
+    # between the workers on the same host. Every cache is limited by its own `*_CACHE_MAX_*` settings.
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', os.path.join(basedir, '..', 'instance', 'cache.sqlite3'))
+    # Durable log of the deleted movies shared by all workers, and the interval in seconds at which every worker picks
+    # up the deletions of the others.
+    DELETED_MOVIES_PATH = os.getenv('DELETED_MOVIES_PATH',
+                                    os.path.join(basedir, '..', 'instance', 'deleted_movies.sqlite3'))
+    DELETED_MOVIES_REFRESH_INTERVAL = 1.0
+    # Local mirror of the movie metadata shared by all workers, and the age in seconds up to which mirrored movies and
+    # lists are served without asking the upstream. Older copies are still served while the upstream is unavailable.
+    MIRROR_PATH = os.getenv('MIRROR_PATH', os.path.join(basedir, '..', 'instance', 'mirror.sqlite3'))
+    MIRROR_MAX_AGE = 6 * 60 * 60
+    MIRROR_LIST_MAX_AGE = 60 * 60
+    # Background sync of the mirror: interval in seconds between sweeps and the number of popular pages swept.
+    MIRROR_SYNC = os.getenv('MIRROR_SYNC', '0') == '1'
+    MIRROR_SYNC_INTERVAL = 30 * 60
+    MIRROR_SYNC_PAGES = int(os.getenv('MIRROR_SYNC_PAGES', 10))
+    # The similar movies are looked up in the in-memory indexes of the mirrored movies once they hold this many movies,
+    # before that TMDB is asked. The indexes pick up newly mirrored movies every interval seconds.
+    MIRROR_INDEX_MIN_MOVIES = int(os.getenv('MIRROR_INDEX_MIN_MOVIES', 1000))
+    MIRROR_INDEX_REFRESH_INTERVAL = 5
+    # Warm the caches when a worker starts: the details and the similar movies of this many popular movies are
+    # fetched by at most this many threads at a time.
+    WARMUP = os.getenv('WARMUP', '0') == '1'
+    WARMUP_MOVIES = int(os.getenv('WARMUP_MOVIES', 100))
+    WARMUP_CONCURRENCY = 4
+    # Maximum number of movie ids of a single `/movie/average-scores` request.
+    AVERAGE_SCORES_MAX_IDS = 50
+    # Maximum number of movie ids of a single `/movie/batch` request.
+    BATCH_MAX_IDS = 100
+    # Seconds the rendered charts of `/movie/average-scores` are cached, and clients may reuse them. A chart never
+    # changes, its url holds the hash of its contents and the movie ids it is rebuilt from once the cache dropped it.
+    CHART_CACHE_TTL = 7 * 24 * 60 * 60
+    CHART_MAX_AGE = 365 * 24 * 60 * 60
+    CHART_CACHE_MAX_ENTRIES = int(os.getenv('CHART_CACHE_MAX_ENTRIES', 1000))
+    CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    # `/movie/top-movies/<amount>` streams its results when more movies than this are requested.
+    TOP_MOVIES_STREAM_THRESHOLD = 200
+    # Interval in seconds between background refreshes of the genre list.
+    GENRES_REFRESH_INTERVAL = 24 * 60 * 60
+    # Server of `manage.py`: 'wsgi' for the Flask server or 'asgi' for uvicorn. The application stays a WSGI application
+    # in both modes: under uvicorn it runs behind a2wsgi, every request holding a thread of the pool until it completes.
+    SERVER = os.getenv('API_SERVER', 'wsgi')
+    # Size of the thread pool running the WSGI application under the ASGI server, the maximum number of concurrent
+    # requests per worker.
+    ASGI_THREADS = int(os.getenv('ASGI_THREADS', 32))
+    # Seconds clients may reuse the responses of these routes without revalidating them, the responses of all other
+    # routes carry an ETag but must be revalidated. Deleted movies can show up in reused responses for this long.
+    CACHE_CONTROL_MAX_AGE = {
+        '/api/movie/<int:movie_id>': 60,
+        '/api/movie/<int:movie_id>/cast': 60,
+        '/api/movie/average-scores': 60,
+        '/api/movie/top-movies/<int:amount>': 30,
+        '/api/movie/similar-genre/<int:movie_id>': 30,
+        '/api/movie/similar-runtime/<int:movie_id>': 30,
+        '/api/movie/overlapping-actors/<int:movie_id>': 30,
+    }
+    # Responses of at least this many bytes are compressed with brotli or gzip, the compressed bodies of hot responses
+    # and static assets are cached.
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+    COMPRESS_CACHE_MAX_ENTRIES = 1024
+    COMPRESS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    # Add a `Server-Timing` header with the upstream, marshalling and total time to every API response.
+    SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
 
 
 class DevelopmentConfig(Config):
@@ -17,6 +122,7 @@ class DevelopmentConfig(Config):
     The configuration class for the Flask application when in development mode.
     """
     DEBUG = True
+    SERVER_TIMING = os.getenv('SERVER_TIMING', '1') == '1'
 
 
 class ProductionConfig(Config):
@@ -24,6 +130,10 @@ class ProductionConfig(Config):
     The configuration class for the Flask application when in production mode.
     """
     DEBUG = False
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    TMDB_RATE_LIMIT_BACKEND = os.getenv('TMDB_RATE_LIMIT_BACKEND', 'sqlite')
+    MIRROR_SYNC = os.getenv('MIRROR_SYNC', '1') == '1'
+    WARMUP = os.getenv('WARMUP', '1') == '1'
     # uncomment the line below to use postgres
     # SQLALCHEMY_DATABASE_URI = postgres_local_base
 
@@ -1,12 +1,15 @@
-import requests
-import os
+import asyncio
 
 from flask import request
 from flask_restx import Resource
 
+from ..service.session_cache import session_cache
+from ..service.tmdb_async import tmdb_async
+from ..util.aio import asynchronous
 from ..util.dto import AccountDto
 from ..util.dto import MovieDto
-from ..util.decoratorMovies import filter_deleted_movies_func
+from ..util.decoratorMovies import paginate_filtered_async
+from ..util.marshalling import marshal_with
 
 # Create namespace for controller.
 ns = AccountDto.api
@@ -27,17 +30,37 @@ parser.add_argument(
     help="Session_id, required for account related operations.",
 )
 
+# Create parser for paginated account resources.
+parser_paginated = parser.copy()
+# Add page query param.
+parser_paginated.add_argument(
+    "page",
+    type=int,
+    required=False,
+    default=1,
+    help="Page number",
+)
+# Add per_page query param.
+parser_paginated.add_argument(
+    "per_page",
+    type=int,
+    required=False,
+    default=20,
+    help="Number of results per page",
+)
+
 
 @ns.route('/')
 @ns.response(401, "Authentication failed, no permission to this service.")
 @ns.response(404, "Resource was not found.")
 class Account(Resource):
     @ns.doc('get_account')
-    @ns.marshal_with(_account, envelope='data', code=200)
+    @marshal_with(ns, _account, envelope='data', code=200)
     @ns.expect(parser, validate=True)
-    def get(self):
+    @asynchronous
+    async def get(self):
         """
-        Account resource endpoint for retrieving account information.
+        Account resource endpoint for retrieving account information, cached per session.
 
         :return: Returns account information in JSON format.
         :raise 401: Authentication failed, no permission to this service.
@@ -45,19 +68,15 @@ class Account(Resource):
         """
         # Parse query args.
         args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'session_id': args['session_id'],
-                  'language': 'en-US'}
 
-        response = requests.get(
-            url='https://api.themoviedb.org/3/account', params=params
-        )
+        status, body = await session_cache.get_json('account', args['session_id'])
 
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 401:
-            return ns.abort(401, response.json()['status_message'])
-        elif response.status_code == 404:
-            return ns.abort(404, response.json()['status_message'])
+        if status == 200:
+            return body
+        elif status == 401:
+            return ns.abort(401, body['status_message'])
+        elif status == 404:
+            return ns.abort(404, body['status_message'])
         else:
             return ns.abort(404, "Resource was not found")
 
@@ -67,11 +86,12 @@ class Account(Resource):
 @ns.response(404, "Resource was not found.")
 class AccountFavorite(Resource):
     @ns.doc('post_account_favorite')
-    @ns.marshal_with(_fav_response, envelope='data', code=200)
+    @marshal_with(ns, _fav_response, envelope='data', code=200)
     @ns.expect(_fav_body, parser, validate=True)
-    def post(self, account_id):
+    @asynchronous
+    async def post(self, account_id):
         """
-        Add a movie or TV show to the user's favorites list.
+        Add a movie or TV show to the user's favorites list, the cached account responses of the session are dropped.
 
         :param account_id: The account ID of the user.
         :return: The response data, which contains the movie or TV show that was added to the user's favorites list.
@@ -80,14 +100,12 @@ class AccountFavorite(Resource):
         """
         # Parse query args.
         args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'session_id': args['session_id'],
-                  'language': 'en-US'}
+        params = {'session_id': args['session_id']}
 
-        response = requests.post(
-            url=f'https://api.themoviedb.org/3/account/{account_id}/favorite', params=params, json=request.json,
-        )
+        response = await tmdb_async.post(f'account/{account_id}/favorite', params, json=request.json)
 
         if response.status_code in [200, 201]:
+            await asyncio.to_thread(session_cache.invalidate, args['session_id'])
             return response.json()
         elif response.status_code == 401:
             return ns.abort(401, response.json()['status_message'])
@@ -102,11 +120,12 @@ class AccountFavorite(Resource):
 @ns.response(404, "Resource was not found.")
 class AccountFavoriteMovies(Resource):
     @ns.doc('get_account_favorite_movies')
-    @ns.marshal_with(_paginated, envelope='data', code=200)
-    @ns.expect(parser, validate=True)
-    def get(self, account_id):
+    @marshal_with(ns, _paginated, envelope='data', code=200)
+    @ns.expect(parser_paginated, validate=True)
+    @asynchronous
+    async def get(self, account_id):
         """
-        Retrieve a paginated list of the current user's favorite movies.
+        Retrieve a paginated list of the current user's favorite movies, the upstream pages are cached per session.
 
         :param account_id: An integer representing the id of the user account.
         :raises 401: If the authentication fails or if there is no permission to access the service.
@@ -114,19 +133,20 @@ class AccountFavoriteMovies(Resource):
         :return: A paginated response containing the user's favorite movies.
         """
         # Parse query args.
-        args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'session_id': args['session_id'],
-                  'language': 'en-US'}
-
-        response = requests.get(
-            url=f'https://api.themoviedb.org/3/account/{account_id}/favorite/movies', params=params
-        )
-
-        if response.status_code == 200:
-            return filter_deleted_movies_func(response.json())
-        elif response.status_code == 401:
-            return ns.abort(401, response.json()['status_message'])
-        elif response.status_code == 404:
-            return ns.abort(404, response.json()['status_message'])
-        else:
-            return ns.abort(404, "Resource was not found")
\ No newline at end of file
+        args = parser_paginated.parse_args()
+
+        async def fetch_page(page: int) -> dict:
+            status, body = await session_cache.get_json(f'account/{account_id}/favorite/movies', args['session_id'],
+                                                        {'page': page})
+
+            if status == 200:
+                return body
+            elif status == 401:
+                return ns.abort(401, body['status_message'])
+            elif status == 404:
+                return ns.abort(404, body['status_message'])
+            else:
+                return ns.abort(404, "Resource was not found")
+
+        return await paginate_filtered_async(fetch_page, max(1, min(args['page'], 500)),
+                                             max(1, min(args['per_page'], 100)))
\ No newline at end of file
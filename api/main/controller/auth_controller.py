@@ -1,10 +1,13 @@
-import requests
-import os
+import asyncio
 
 from flask import request
 from flask_restx import Resource
 
+from ..service.session_cache import session_cache
+from ..service.tmdb_async import tmdb_async
+from ..util.aio import asynchronous
 from ..util.dto import AuthDto
+from ..util.marshalling import marshal_with
 
 # Create namespace for controller.
 ns = AuthDto.api
@@ -19,8 +22,9 @@ _session_id = AuthDto.session_id
 @ns.response(404, "Resource was not found.")
 class NewToken(Resource):
     @ns.doc('get_new_token')
-    @ns.marshal_with(_token, envelope='data', code=200)
-    def get(self):
+    @marshal_with(ns, _token, envelope='data', code=200)
+    @asynchronous
+    async def get(self):
         """
         Endpoint for creating a new authentication token from The Movie DB.
 
@@ -29,11 +33,7 @@ class NewToken(Resource):
         :return: A JSON object containing the newly created authentication token.
         :raise 404: If the request was unsuccessful.
         """
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US'}
-
-        response = requests.get(
-            'https://api.themoviedb.org/3/authentication/token/new', params
-        )
+        response = await tmdb_async.get('authentication/token/new')
         return (
             response.json()
             if response.status_code == 200
@@ -45,9 +45,10 @@ class NewToken(Resource):
 @ns.response(404, "Resource was not found.")
 class NewSession(Resource):
     @ns.doc('post_session')
-    @ns.marshal_with(_session, envelope='data', code=200)
+    @marshal_with(ns, _session, envelope='data', code=200)
     @ns.expect(_request_token, validate=True)
-    def post(self):
+    @asynchronous
+    async def post(self):
         """
         Creates a new session with The Movie DB.
 
@@ -57,10 +58,7 @@ class NewSession(Resource):
         :return: A JSON object containing the newly created session.
         :raise 404: If the request was unsuccessful.
         """
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US'}
-
-        response = requests.post(
-            url='https://api.themoviedb.org/3/authentication/session/new', params=params, data=request.json)
+        response = await tmdb_async.post('authentication/session/new', data=request.json)
 
         return (
             response.json()
@@ -71,19 +69,20 @@ class NewSession(Resource):
     @ns.doc('delete_session')
     @ns.response(200, 'Session successfully deleted')
     @ns.expect(_session_id, validate=True)
-    def delete(self):
+    @asynchronous
+    async def delete(self):
         """
         Deletes the current session with The Movie DB.
 
-        Deletes the current user session, effectively logging the user out of the TMDB.
+        Deletes the current user session, effectively logging the user out of the TMDB. The cached account responses
+        of the session are dropped.
 
         :return: A JSON object containing the status of the deletion request.
         :raise 404: If the request was unsuccessful.
         """
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US'}
-
-        response = requests.delete(
-            url='https://api.themoviedb.org/3/authentication/session', params=params, data=request.json)
+        response = await tmdb_async.delete('authentication/session', data=request.json)
+        if request.json.get('session_id'):
+            await asyncio.to_thread(session_cache.invalidate, request.json['session_id'])
 
         return (
             response.json()
@@ -1,10 +1,16 @@
-import requests
-import os
+from typing import Any, Callable, List, Optional
 
+from flask import Response, current_app, redirect, request
 from flask_restx import Resource
 
+from ..service import movie_service
+from ..service.chart_service import charts
+from ..service.genre_index import RANKINGS
+from ..util.aio import asynchronous
 from ..util.dto import MovieDto
 from ..util.decoratorMovies import filter_deleted_movies_func, add_deleted_movie
+from ..util.marshalling import marshal_list_with, marshal_with, stream_ndjson, stream_paginated
+from ..util.serializer import serialize
 
 # Create namespace for controller.
 ns = MovieDto.api
@@ -46,14 +52,84 @@ parser_average_scores.add_argument(
     action='split'
 )
 
+# Create parser for the chart of the average scores, its movie ids are optional.
+parser_chart = parser_average_scores.copy()
+parser_chart.replace_argument(
+    'movie_ids',
+    type=str,
+    required=False,
+    help='Movie ids the chart is rebuilt from once it expired, comma seperated list of movie ids',
+    action='split'
+)
+
+# Create parser for similar genre movies, paginated.
+parser_similar_genre = parser.copy()
+# Add ranking query param.
+parser_similar_genre.add_argument(
+    "ranking",
+    type=str,
+    required=False,
+    default='exact',
+    choices=RANKINGS,
+    help="'exact' for the movies with exactly the same genres, most popular first, or 'jaccard' for all movies "
+         "sharing a genre, most similar genres first",
+)
+
+
+def _movie_ids(args: dict) -> List[int]:
+    """
+    Parse the distinct movie ids of the `movie_ids` query arg.
+
+    :param args: The parsed query args.
+    :raises 404: If a movie id isn't a number.
+    :return: The movie ids in order, without duplicates.
+    """
+    movie_ids: list = []
+    for movie_id in args['movie_ids']:
+        if not movie_id.strip().isdigit():
+            return ns.abort(404, f"Movie {movie_id} not found.")
+        movie_ids.append(int(movie_id))
+    return list(dict.fromkeys(movie_ids))
+
+
+def _get_movie(movie_id: int) -> dict:
+    """
+    Retrieve the details and credits of a movie, shared by all resources handling the current request.
+
+    :param movie_id: A movie identifier.
+    :raises 404: If the movie does not exist or has been deleted.
+    :return: The movie details with its `credits`.
+    """
+    status, movie = movie_service.get_movie_details(movie_id)
+    if status != 200:
+        return ns.abort(404, f"Movie {movie_id} not found.")
+    return filter_deleted_movies_func(movie)
+
+
+def _similar(find: Callable[..., Optional[dict]], query: Any, args: dict, **kwargs) -> dict:
+    """
+    Find similar movies with a function of `movie_service`, paginated as requested by the `page` and `per_page` query
+    args.
+
+    :param find: The function finding the similar movies.
+    :param query: What the movies must be similar to.
+    :param args: The parsed query args.
+    :raises 404: If the movies couldn't be retrieved.
+    :return: The paginated movies, without the deleted movies.
+    """
+    movies = find(query, max(1, min(args['page'], 500)), max(1, min(args['per_page'], 100)),
+                  current_app.config['MIRROR_INDEX_MIN_MOVIES'], **kwargs)
+    return movies if movies is not None else ns.abort(404, "Resource was not found")
+
 
 @ns.route('/<int:movie_id>')
 @ns.response(404, 'Movie not found.')
 @ns.param('movie_id', 'A movie identifier')
 class Movie(Resource):
     @ns.doc('get_movie')
-    @ns.marshal_with(_movie_details, code=200)
-    def get(self, movie_id):
+    @marshal_with(ns, _movie_details, code=200)
+    @asynchronous
+    async def get(self, movie_id):
         """
         Endpoint to retrieve the details of a movie.
 
@@ -65,13 +141,8 @@ class Movie(Resource):
         :raises 404: If the movie does not exist.
         :return: A JSON object containing the movie's details.
         """
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US'}
-
-        response = requests.get(
-            f'https://api.themoviedb.org/3/movie/{movie_id}',
-            params,
-        )
-        return filter_deleted_movies_func(response.json()) if response.status_code == 200 else ns.abort(404, f"Movie {movie_id} not found.")
+        status, movie = await movie_service.get_movie_details_async(movie_id)
+        return filter_deleted_movies_func(movie) if status == 200 else ns.abort(404, f"Movie {movie_id} not found.")
 
     @ns.doc('delete_movie')
     @ns.response(204, 'Movie successfully deleted')
@@ -85,17 +156,65 @@ class Movie(Resource):
         :param movie_id: A movie identifier.
         :return: An empty response with a 204 status code.
                 """
-        add_deleted_movie(self.get(movie_id))
+        # Check if given movie id exists
+        _get_movie(movie_id)
+
+        add_deleted_movie(movie_id)
         return '', 204
 
 
+@ns.route('/batch')
+@ns.response(400, 'Too many movie ids.')
+@ns.response(404, 'Movie not found.')
+class MovieBatch(Resource):
+    @ns.doc('get_movie_batch')
+    @ns.expect(parser_average_scores)
+    @ns.produces(['application/x-ndjson'])
+    def get(self):
+        """
+        Endpoint to retrieve the details of multiple movies at once.
+
+        The details of all movies are retrieved concurrently and streamed as newline delimited JSON, one line per movie
+        in the order the movies are retrieved, so clients can render every movie as soon as it arrives. Duplicate movie
+        ids are only returned once. A line holds the `id` and `status` of a movie and its details (the `_movie_details`
+        schema) in `data`, or a `message` for ids that aren't numbers (400, with the `id` as given), movies that don't
+        exist, have been deleted (404) or couldn't be retrieved (502).
+
+        :raises 400: If more movie ids than `BATCH_MAX_IDS` are given.
+        :return: A stream of JSON objects containing the movies' details.
+        """
+        # Parse query args.
+        args = parser_average_scores.parse_args()
+        given = list(dict.fromkeys(movie_id.strip() for movie_id in args['movie_ids']))
+        movie_ids = list(dict.fromkeys(int(movie_id) for movie_id in given if movie_id.isdigit()))
+        malformed = [movie_id for movie_id in given if not movie_id.isdigit()]
+
+        max_ids: int = current_app.config['BATCH_MAX_IDS']
+        if len(movie_ids) + len(malformed) > max_ids:
+            return ns.abort(400, f"At most {max_ids} movie ids can be retrieved at once.")
+
+        def records():
+            for movie_id in malformed:
+                yield {'id': movie_id, 'status': 400, 'message': f"Movie id {movie_id} is not a number."}
+            for movie_id, status, movie in movie_service.stream_movie_details(movie_ids):
+                if status == 200:
+                    yield {'id': movie_id, 'status': status, 'data': serialize(movie, _movie_details)}
+                elif status == 404:
+                    yield {'id': movie_id, 'status': status, 'message': f"Movie {movie_id} not found."}
+                else:
+                    yield {'id': movie_id, 'status': status, 'message': "Movie could not be retrieved."}
+
+        return stream_ndjson(records())
+
+
 @ns.route('/<int:movie_id>/cast')
 @ns.response(404, 'Movie not found.')
 @ns.param('movie_id', 'A movie identifier')
 class MovieCast(Resource):
     @ns.doc('get_movie_cast')
-    @ns.marshal_list_with(_cast, envelope='data', code=200)
-    def get(self, movie_id):
+    @marshal_list_with(ns, _cast, envelope='data', code=200)
+    @asynchronous
+    async def get(self, movie_id):
         """
         Endpoint to retrieve the cast list of a movie.
 
@@ -105,58 +224,44 @@ class MovieCast(Resource):
         :raises 404: If the movie does not exist.
         :return: A JSON object containing the movie's cast.
         """
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US'}
-
-        # Check if given movie id exists
-        Movie().get(movie_id)
-
-        response = requests.get(
-            f'https://api.themoviedb.org/3/movie/{movie_id}/credits',
-            params,
-        )
-        return response.json()['cast'] if response.status_code == 200 else ns.abort(404, f"Movie {movie_id} not found.")
+        # Retrieve the movie, to check if the given movie id exists, together with its credits.
+        status, movie = await movie_service.get_movie_details_async(movie_id)
+        if status != 200:
+            return ns.abort(404, f"Movie {movie_id} not found.")
+        filter_deleted_movies_func(movie)
+        return movie['credits']['cast']
 
 
 @ns.route('/top-movies/<int:amount>')
+@ns.response(404, 'Resource was not found.')
 @ns.param('amount', 'Amount of top movies')
 class TopMovies(Resource):
     @ns.doc('get_top_movies')
-    @ns.marshal_list_with(_paginated, envelope='data', code=200)
+    @marshal_list_with(ns, _paginated, envelope='data', code=200)
     @ns.expect(parser)
     def get(self, amount):
         """
         Retrieves the top movies from The Movie Database API.
 
+        All popular pages that are needed are fetched concurrently, deleted movies are left out. When more than `TOP_MOVIES_STREAM_THRESHOLD` movies
+        are requested, the movies are streamed as soon as their page arrives.
+
         :param amount: The number of top movies to retrieve.
+        :raises 404: If the popular movies couldn't be retrieved.
         :return: A paginated list of popular movies in descending order of popularity.
         """
         # Parse query args.
-        global response
         args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US', 'page': min(args['page'], 500)}
-
-        top_movies: list = []
-        while len(top_movies) < amount:
-            response = requests.get(
-                'https://api.themoviedb.org/3/movie/popular',
-                params,
-            )
-            total_movies: int = response.json()['total_results']
-            # Get the number of results per page.
-            per_page: int = len(response.json()['results'])
-            # Get the number of total pages.
-            total_pages: int = min(total_movies // per_page, response.json()['total_pages'])
-            # Add to list of movies.
-            top_movies += response.json()['results'][:amount - len(top_movies)]
-            if params['page'] >= total_pages:
-                break
-            # Increase page param.
-            params['page'] += 1
-
-        # response.json()['results'] = top_movies
-        response = response.json()
-        response['results'] = top_movies
-        return filter_deleted_movies_func(response)
+
+        popular = movie_service.get_popular_movies(amount, max(1, min(args['page'], 500)))
+        if popular is None:
+            return ns.abort(404, "Resource was not found")
+        page, movies = popular
+
+        if amount > current_app.config['TOP_MOVIES_STREAM_THRESHOLD']:
+            return stream_paginated(page, movies, _movie)
+        results = list(movies)
+        return page | {'results': results}
 
 
 @ns.route('/similar-genre/<int:movie_id>')
@@ -164,47 +269,30 @@ class TopMovies(Resource):
 @ns.param('movie_id', 'A movie identifier')
 class SimilarGenreMovies(Resource):
     @ns.doc('get_similar_genre_movies')
-    @ns.marshal_list_with(_paginated, envelope='data', code=200)
-    @ns.expect(parser)
+    @marshal_list_with(ns, _paginated, envelope='data', code=200)
+    @ns.expect(parser_similar_genre)
     def get(self, movie_id):
         """
-        Get a list of movies that have the exact same genres.
+        Get a list of movies with genres similar to the given movie.
+
+        With the default 'exact' ranking these are the movies with exactly the same genres, most popular first. With
+        the 'jaccard' ranking these are all movies sharing a genre, ordered by the Jaccard similarity of their genres.
 
         :param movie_id: The identifier of the movie to retrieve the similar genre movies.
         :raises 404: If the movie does not exist.
-        :return: A list of movies that share the exact same genres.
+        :return: A list of movies that share the exact same genres, or with the 'jaccard' ranking a list of movies
+            sharing a genre, the most similar genres first.
         """
         # Parse query args.
-        args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US', 'page': min(args['page'], 500)}
+        args = parser_similar_genre.parse_args()
 
         # Check if given movie id exists
-        response = Movie().get(movie_id)
-
-        # Retrieve all genres.
-        genres_all: list = requests.get('https://api.themoviedb.org/3/genre/movie/list', {
-            'api_key': os.environ.get('THEMOVIEDB_API_KEY'),
-            'language': 'en-US'
-        }).json()['genres']
-        genres_all_ids: list = [d['id'] for d in genres_all]
+        response = _get_movie(movie_id)
 
         # Retrieve details from response
-        movie_genres = response['genres']
-        movie_genres = [d['id'] for d in movie_genres]
+        movie_genres = [d['id'] for d in response['genres']]
 
-        # Calculate all genres that are not in those of the given movie.
-        different_genres = set(genres_all_ids).difference(set(movie_genres))
-
-        # Update params.
-        params |= {
-            'with_genres': ','.join(str(v) for v in movie_genres),
-            'without_genres': ','.join(str(v) for v in different_genres)
-        }
-
-        return filter_deleted_movies_func(requests.get(
-            'https://api.themoviedb.org/3/discover/movie',
-            params
-        ).json())
+        return _similar(movie_service.similar_genre_movies, movie_genres, args, ranking=args['ranking'])
 
 
 @ns.route('/similar-runtime/<int:movie_id>')
@@ -212,7 +300,7 @@ class SimilarGenreMovies(Resource):
 @ns.param('movie_id', 'A movie identifier')
 class SimilarRuntimeMovies(Resource):
     @ns.doc('get_similar_runtime_movies')
-    @ns.marshal_list_with(_paginated, envelope='data', code=200)
+    @marshal_list_with(ns, _paginated, envelope='data', code=200)
     @ns.expect(parser)
     def get(self, movie_id):
         """
@@ -224,22 +312,12 @@ class SimilarRuntimeMovies(Resource):
         """
         # Parse query args.
         args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US', 'page': min(args['page'], 500)}
 
         # Check if given movie id exists
-        response = Movie().get(movie_id)
-
-        # Update params.
-        params |= {
-            # Maximum difference of 10 in runtime.
-            'with_runtime.lte': response['runtime'] + 10,
-            'with_runtime.gte': response['runtime'] - 10
-        }
+        response = _get_movie(movie_id)
 
-        return filter_deleted_movies_func(requests.get(
-            'https://api.themoviedb.org/3/discover/movie',
-            params
-        ).json())
+        # Maximum difference of 10 in runtime.
+        return _similar(movie_service.similar_runtime_movies, response['runtime'], args)
 
 
 @ns.route('/overlapping-actors/<int:movie_id>')
@@ -247,11 +325,11 @@ class SimilarRuntimeMovies(Resource):
 @ns.param('movie_id', 'A movie identifier')
 class OverlappingActorsMovies(Resource):
     @ns.doc('get_overlapping_actors_movies')
-    @ns.marshal_list_with(_paginated, envelope='data', code=200)
+    @marshal_list_with(ns, _paginated, envelope='data', code=200)
     @ns.expect(parser)
     def get(self, movie_id):
         """
-        Get a list of movies that share actors with the given movie.
+        Get a list of movies that share actors with the given movie, the movies sharing the most actors first.
 
         :param movie_id: The identifier of the movie to retrieve overlapping actors.
         :raises 404: If the movie does not exist.
@@ -259,47 +337,114 @@ class OverlappingActorsMovies(Resource):
         """
         # Parse query args.
         args = parser.parse_args()
-        params = {'api_key': os.environ.get('THEMOVIEDB_API_KEY'), 'language': 'en-US', 'page': min(args['page'], 500)}
 
         # Retrieve movie cast.
-        response = MovieCast().get(movie_id)
+        response = _get_movie(movie_id)
 
-        # Update params.
-        params |= {
-            # Maximum difference of 10 in runtime.
-            'with_cast': ','.join(str(v['id']) for v in response['data'][:2]),
-        }
+        # The whole cast, leading actors first.
+        return _similar(movie_service.overlapping_actors_movies, [v['id'] for v in response['credits']['cast']], args)
+
+
+def _compared_movies(movie_ids: List[int]) -> List[dict]:
+    """
+    Retrieve the movies whose average scores are compared.
+
+    :param movie_ids: The distinct movie identifiers.
+    :raises 400: If more movie ids than `AVERAGE_SCORES_MAX_IDS` are given.
+    :raises 404: If a movie is not found.
+    :return: The details of the movies in order.
+    """
+    max_ids: int = current_app.config['AVERAGE_SCORES_MAX_IDS']
+    if len(movie_ids) > max_ids:
+        return ns.abort(400, f"At most {max_ids} movie ids can be compared.")
 
-        return filter_deleted_movies_func(requests.get(
-            'https://api.themoviedb.org/3/discover/movie',
-            params
-        ).json())
+    movies: list = movie_service.get_movies(movie_ids)
+    for movie_id, movie in zip(movie_ids, movies):
+        if movie is None:
+            return ns.abort(404, f"Movie {movie_id} not found.")
+    return movies
+
+
+def _chart_url(chart_hash: str, movie_ids: List[int]) -> str:
+    """
+    Get the url of a chart of average scores, holding the movie ids it is rebuilt from once it expired.
+    """
+    return ns.apis[0].url_for(AverageScoresChart, chart_hash=chart_hash,
+                              movie_ids=','.join(str(movie_id) for movie_id in movie_ids), _external=True)
 
 
 @ns.route('/average-scores')
+@ns.response(400, 'Too many movie ids.')
 @ns.response(404, 'Movie not found.')
 class AverageScores(Resource):
     @ns.doc('get_average_scores')
-    @ns.marshal_with(_average_scores, envelope='data', code=200)
+    @marshal_with(ns, _average_scores, envelope='data', code=200)
     @ns.expect(parser_average_scores)
     def get(self):
         """
         Endpoint to get the average scores of movies.
 
+        The details of all movies are retrieved concurrently, duplicate movie ids are only returned once.
+
+        The chart of the average scores is rendered locally, its url points to `/movie/average-scores/chart`.
+
+        :raises 400: If more movie ids than `AVERAGE_SCORES_MAX_IDS` are given.
         :raises 404: If the movie is not found.
         :return: Returns a dictionary containing a chart and a list of movies with their average scores.
         """
         # Parse query args.
         args = parser_average_scores.parse_args()
 
-        chart_endpoint: str = 'https://quickchart.io/chart/render/zm-cfc18cf3-356e-4c89-b6df-eae582af4a7c'
-        movies: list = []
-
-        for movie_id in args['movie_ids']:
-            response = Movie().get(movie_id)
-            movies.append(response)
+        movie_ids = _movie_ids(args)
+        movies = _compared_movies(movie_ids)
 
+        chart_hash, _ = charts.bar_chart('Average Score', [str(v['title']) for v in movies],
+                                         [float(v['vote_average']) for v in movies])
         return {
-            'chart': f"{chart_endpoint}?data1={','.join(str(v['vote_average']) for v in movies)}&labels={','.join(str(v['title']) for v in movies)}&title=Average Score",
+            'chart': _chart_url(chart_hash, movie_ids),
             'movies': movies
         }
+
+
+@ns.route('/average-scores/chart/<string:chart_hash>')
+@ns.response(302, 'The scores changed, the chart moved to a new hash.')
+@ns.response(404, 'Chart not found.')
+@ns.param('chart_hash', 'The content hash of a chart')
+class AverageScoresChart(Resource):
+    @ns.doc('get_average_scores_chart')
+    @ns.produces(['image/svg+xml'])
+    @ns.expect(parser_chart)
+    def get(self, chart_hash):
+        """
+        Endpoint to get a chart of average scores as SVG.
+
+        Charts are addressed by the hash of their contents and never change, so clients may cache them for
+        `CHART_MAX_AGE` seconds. A chart that isn't cached anymore is rebuilt from the movie ids of its url, when the
+        scores of the movies changed since, the request is redirected to the url of the new chart.
+
+        :param chart_hash: The content hash of the chart, as linked by `/movie/average-scores`.
+        :raises 404: If the chart is not found and can't be rebuilt.
+        :return: The chart as SVG.
+        """
+        chart = charts.get(chart_hash)
+        if chart is None:
+            # Parse query args.
+            args = parser_chart.parse_args()
+            if not args['movie_ids']:
+                return ns.abort(404, f"Chart {chart_hash} not found.")
+
+            movie_ids = _movie_ids(args)
+            movies = _compared_movies(movie_ids)
+            rebuilt, chart = charts.bar_chart('Average Score', [str(v['title']) for v in movies],
+                                              [float(v['vote_average']) for v in movies])
+            if rebuilt != chart_hash:
+                return redirect(_chart_url(rebuilt, movie_ids))
+
+        response = Response(chart, mimetype='image/svg+xml')
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['CHART_MAX_AGE']
+        response.cache_control.immutable = True
+        # The chart is served from our origin, it must not load or run anything.
+        response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+        response.set_etag(chart_hash)
+        return response.make_conditional(request)
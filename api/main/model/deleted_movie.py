@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import FrozenSet, List, Optional
+
+
+class DeletedMovies:
+    """
+    Durable store of the deleted movies, shared by all workers on the same host.
+
+    Deletions are appended to a SQLite log, every worker keeps an in-memory set of the deleted movie ids that is
+    replayed from the log at startup and then refreshed incrementally, at most every `refresh_interval` seconds, with
+    the entries appended since the last refresh. Membership checks are a set lookup.
+
+    The set is copy-on-write: changes swap in a new frozenset, so readers can iterate a snapshot without the lock.
+    """
+
+    def __init__(self, path: Optional[str] = None, refresh_interval: float = 1.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._ids: FrozenSet[int] = frozenset()
+        self._last_seq = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """
+        Configure the store from the settings of the given Flask application and replay its log.
+
+        :param app: The Flask application instance.
+        """
+        self.path = app.config['DELETED_MOVIES_PATH']
+        self.refresh_interval = app.config['DELETED_MOVIES_REFRESH_INTERVAL']
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS deleted_movies ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, movie_id INTEGER NOT NULL UNIQUE, deleted_at REAL NOT NULL)'
+            )
+        with self._lock:
+            self._ids = frozenset()
+            self._last_seq = 0
+        self.refresh()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, connections can't be shared between threads.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def refresh(self):
+        """
+        Add the deletions appended to the log by any worker since the last refresh.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT seq, movie_id FROM deleted_movies WHERE seq > ? ORDER BY seq', (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._ids = self._ids.union(movie_id for _, movie_id in rows)
+                self._last_seq = rows[-1][0]
+            self._refreshed_at = time.monotonic()
+
+    def _refresh_if_due(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+    def add(self, movie_id: int):
+        """
+        Record the deletion of a movie.
+
+        :param movie_id: A movie identifier.
+        """
+        if self.path is not None:
+            with self._connection() as connection:
+                connection.execute(
+                    'INSERT OR IGNORE INTO deleted_movies (movie_id, deleted_at) VALUES (?, ?)',
+                    (movie_id, time.time()),
+                )
+        with self._lock:
+            if movie_id not in self._ids:
+                self._ids = self._ids | {movie_id}
+
+    def ids(self) -> List[int]:
+        """
+        Get the identifiers of all deleted movies.
+        """
+        self._refresh_if_due()
+        return list(self._ids)
+
+    def snapshot(self) -> FrozenSet[int]:
+        """
+        Get the set of deleted movie ids, for checking many movies at once without refreshing for every one of them.
+        Later deletions don't change the returned set.
+        """
+        self._refresh_if_due()
+        return self._ids
+
+    def __contains__(self, movie_id) -> bool:
+        self._refresh_if_due()
+        return movie_id in self._ids
+
+    def __len__(self) -> int:
+        self._refresh_if_due()
+        return len(self._ids)
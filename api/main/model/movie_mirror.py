@@ -0,0 +1,269 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Fields of a movie in lists such as the popular and discovered movies, in the order of the upstream lists.
+SUMMARY_FIELDS = ('adult', 'backdrop_path', 'genre_ids', 'id', 'original_language', 'original_title', 'overview',
+                  'popularity', 'poster_path', 'release_date', 'title', 'video', 'vote_average', 'vote_count')
+
+
+def summarize(movie: dict) -> dict:
+    """
+    Get the list representation of a movie from its details.
+
+    :param movie: The movie details.
+    :return: The movie as it appears in lists, with the ids of its genres.
+    """
+    summary = {field: movie.get(field) for field in SUMMARY_FIELDS}
+    summary['genre_ids'] = [genre['id'] for genre in movie.get('genres') or ()]
+    return summary
+
+
+class MovieMirror:
+    """
+    Local copy of the movie metadata of The Movie Database, shared by all workers on the same host.
+
+    Movies are stored with their details and credits and their list representation, indexed on genre, cast, runtime
+    and popularity. Lists such as the popular pages and the genre list are stored by their upstream path. Every row
+    remembers when it was synced, reads only return rows younger than `max_age` unless stale rows are explicitly asked
+    for.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_age: float = 6 * 60 * 60, list_max_age: float = 60 * 60):
+        self.path = path
+        self.max_age = max_age
+        self.list_max_age = list_max_age
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """
+        Configure the mirror from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.path = app.config['MIRROR_PATH']
+        self.max_age = app.config['MIRROR_MAX_AGE']
+        self.list_max_age = app.config['MIRROR_LIST_MAX_AGE']
+        with self._connection() as connection:
+            has_cast = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movie_cast'").fetchone() is not None
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS movies ('
+                'id INTEGER PRIMARY KEY, body BLOB NOT NULL, runtime INTEGER, popularity REAL, synced_at REAL NOT NULL);'
+                'CREATE INDEX IF NOT EXISTS movies_runtime ON movies (runtime);'
+                'CREATE INDEX IF NOT EXISTS movies_popularity ON movies (popularity);'
+                'CREATE INDEX IF NOT EXISTS movies_synced_at ON movies (synced_at);'
+                'CREATE TABLE IF NOT EXISTS movie_genres ('
+                'genre_id INTEGER NOT NULL, movie_id INTEGER NOT NULL, PRIMARY KEY (genre_id, movie_id)) WITHOUT ROWID;'
+                'CREATE INDEX IF NOT EXISTS movie_genres_movie ON movie_genres (movie_id);'
+                'CREATE TABLE IF NOT EXISTS movie_cast ('
+                'actor_id INTEGER NOT NULL, movie_id INTEGER NOT NULL, PRIMARY KEY (actor_id, movie_id)) WITHOUT ROWID;'
+                'CREATE INDEX IF NOT EXISTS movie_cast_movie ON movie_cast (movie_id);'
+                'CREATE TABLE IF NOT EXISTS lists (key TEXT PRIMARY KEY, body BLOB NOT NULL, synced_at REAL NOT NULL);'
+                'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL);'
+            )
+            # Mirrors created before the list representation was stored.
+            if 'summary' not in {row[1] for row in connection.execute('PRAGMA table_info(movies)')}:
+                connection.execute('ALTER TABLE movies ADD COLUMN summary BLOB')
+            # Mirrors created before the cast was indexed, the cast is taken from the mirrored credits.
+            if not has_cast:
+                connection.execute(
+                    "INSERT OR IGNORE INTO movie_cast (actor_id, movie_id) SELECT json_extract(credit.value, '$.id'), "
+                    "movies.id FROM movies, json_each(movies.body, '$.credits.cast') AS credit"
+                )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, connections can't be shared between threads.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def movie(self, movie_id: int, stale: bool = False) -> Optional[dict]:
+        """
+        Get a mirrored movie.
+
+        :param movie_id: A movie identifier.
+        :param stale: Also return the movie when it is older than `max_age`.
+        :return: The movie details with its `credits`, or None if the movie isn't mirrored (or too old).
+        """
+        if self.path is None:
+            return None
+        row = self._connection().execute('SELECT body, synced_at FROM movies WHERE id = ?', (movie_id,)).fetchone()
+        if row is None or not stale and time.time() - row[1] >= self.max_age:
+            return None
+        return json.loads(row[0])
+
+    def put_movie(self, movie: dict):
+        """
+        Mirror a movie, replacing the earlier copy.
+
+        :param movie: The movie details with its `credits`.
+        """
+        self.put_movies([movie])
+
+    def put_movies(self, movies: Iterable[dict]):
+        if self.path is None:
+            return
+        now = time.time()
+        with self._connection() as connection:
+            for movie in movies:
+                connection.execute(
+                    'INSERT OR REPLACE INTO movies (id, body, summary, runtime, popularity, synced_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (movie['id'], json.dumps(movie), json.dumps(summarize(movie)), movie.get('runtime'),
+                     movie.get('popularity'), now),
+                )
+                connection.execute('DELETE FROM movie_genres WHERE movie_id = ?', (movie['id'],))
+                connection.executemany(
+                    'INSERT OR IGNORE INTO movie_genres (genre_id, movie_id) VALUES (?, ?)',
+                    [(genre['id'], movie['id']) for genre in movie.get('genres') or ()],
+                )
+                connection.execute('DELETE FROM movie_cast WHERE movie_id = ?', (movie['id'],))
+                connection.executemany(
+                    'INSERT OR IGNORE INTO movie_cast (actor_id, movie_id) VALUES (?, ?)',
+                    [(actor['id'], movie['id']) for actor in (movie.get('credits') or {}).get('cast') or ()],
+                )
+
+    def summaries(self, movie_ids: Iterable[int]) -> Dict[int, dict]:
+        """
+        Get the list representation of mirrored movies, whatever their age.
+
+        :param movie_ids: The movie identifiers.
+        :return: The movies by identifier, movies that aren't mirrored are left out.
+        """
+        movie_ids = list(movie_ids)
+        if self.path is None or not movie_ids:
+            return {}
+        rows = self._connection().execute(
+            f'SELECT id, summary, body FROM movies WHERE id IN ({",".join("?" * len(movie_ids))})', movie_ids
+        )
+        return {movie_id: json.loads(summary) if summary is not None else summarize(json.loads(body))
+                for movie_id, summary, body in rows}
+
+    def synced_since(self, since: float) -> Iterator[Tuple[int, Optional[int], Optional[float], float]]:
+        """
+        Iterate over the movies synced after the given time, oldest first.
+
+        :param since: The timestamp.
+        :return: The (id, runtime, popularity, synced_at) of every movie.
+        """
+        if self.path is None:
+            return iter(())
+        return self._connection().execute(
+            'SELECT id, runtime, popularity, synced_at FROM movies WHERE synced_at > ? ORDER BY synced_at', (since,)
+        )
+
+    def genres_since(self, since: float) -> Dict[int, List[int]]:
+        """
+        Get the genres of the movies synced after the given time.
+
+        :param since: The timestamp.
+        :return: The genre identifiers by movie identifier, movies without genres are left out.
+        """
+        if self.path is None:
+            return {}
+        genres: Dict[int, List[int]] = {}
+        for movie_id, genre_id in self._connection().execute(
+                'SELECT g.movie_id, g.genre_id FROM movie_genres g JOIN movies m ON m.id = g.movie_id '
+                'WHERE m.synced_at > ?', (since,)):
+            genres.setdefault(movie_id, []).append(genre_id)
+        return genres
+
+    def cast_since(self, since: float) -> Dict[int, List[int]]:
+        """
+        Get the cast of the movies synced after the given time.
+
+        :param since: The timestamp.
+        :return: The actor identifiers by movie identifier, movies without cast are left out.
+        """
+        if self.path is None:
+            return {}
+        cast: Dict[int, List[int]] = {}
+        for movie_id, actor_id in self._connection().execute(
+                'SELECT c.movie_id, c.actor_id FROM movie_cast c JOIN movies m ON m.id = c.movie_id '
+                'WHERE m.synced_at > ?', (since,)):
+            cast.setdefault(movie_id, []).append(actor_id)
+        return cast
+
+    def outdated(self, movie_ids: Iterable[int], max_age: float) -> List[int]:
+        """
+        Get the movies that aren't mirrored or were synced longer than `max_age` seconds ago.
+
+        :param movie_ids: The movie identifiers.
+        :param max_age: The maximum age in seconds.
+        :return: The identifiers of the outdated movies, in the given order.
+        """
+        movie_ids = list(dict.fromkeys(movie_ids))
+        if self.path is None or not movie_ids:
+            return movie_ids
+        placeholders = ','.join('?' * len(movie_ids))
+        recent = {row[0] for row in self._connection().execute(
+            f'SELECT id FROM movies WHERE id IN ({placeholders}) AND synced_at > ?',
+            (*movie_ids, time.time() - max_age),
+        )}
+        return [movie_id for movie_id in movie_ids if movie_id not in recent]
+
+    def list(self, key: str, stale: bool = False) -> Optional[Any]:
+        """
+        Get a mirrored list.
+
+        :param key: The cache key of the upstream call of the list, see `ResponseCache.key`.
+        :param stale: Also return the list when it is older than `list_max_age`.
+        :return: The body of the list, or None if the list isn't mirrored (or too old).
+        """
+        if self.path is None:
+            return None
+        row = self._connection().execute('SELECT body, synced_at FROM lists WHERE key = ?', (key,)).fetchone()
+        if row is None or not stale and time.time() - row[1] >= self.list_max_age:
+            return None
+        return json.loads(row[0])
+
+    def put_list(self, key: str, body: Any):
+        if self.path is None:
+            return
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO lists (key, body, synced_at) VALUES (?, ?, ?)', (key, json.dumps(body), time.time())
+            )
+
+    def acquire(self, name: str, holder: str, duration: float) -> bool:
+        """
+        Acquire or extend a lease, so a job only runs in one worker at a time.
+
+        :param name: The name of the lease.
+        :param holder: The identifier of the worker.
+        :param duration: The duration of the lease in seconds.
+        :return: Whether the worker holds the lease.
+        """
+        now = time.time()
+        with self._connection() as connection:
+            cursor = connection.execute(
+                'INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+                'WHERE leases.expires_at < ? OR leases.holder = excluded.holder',
+                (name, holder, now + duration, now),
+            )
+            return cursor.rowcount == 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Get the number of mirrored movies and lists and the time of the oldest and latest sync of a movie.
+        """
+        if self.path is None:
+            return {}
+        connection = self._connection()
+        movies, oldest, latest = connection.execute(
+            'SELECT COUNT(*), COALESCE(MIN(synced_at), 0), COALESCE(MAX(synced_at), 0) FROM movies'
+        ).fetchone()
+        lists = connection.execute('SELECT COUNT(*) FROM lists').fetchone()[0]
+        return {'movies': movies, 'lists': lists, 'oldest_sync': oldest, 'latest_sync': latest}
@@ -0,0 +1,77 @@
+import heapq
+from array import array
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+from .mirror_index import MirrorIndex
+
+
+class ActorIndex(MirrorIndex):
+    """
+    Inverted index of the mirrored movies from actor to the movies they play in.
+
+    Every actor has a posting list of movie ids. The movies sharing cast with a movie are counted by walking the
+    posting lists of its whole cast, the best ranked are picked with a heap instead of sorting all of them.
+    """
+
+    def clear(self):
+        self._postings: Dict[int, array] = {}
+        self._cast: Dict[int, FrozenSet[int]] = {}
+        self._popularity: Dict[int, float] = {}
+
+    def size(self) -> int:
+        return len(self._cast)
+
+    def _read(self, since: float) -> List[Tuple]:
+        cast = self.mirror.cast_since(since)
+        return [(movie_id, popularity, frozenset(cast.get(movie_id, ())), synced_at)
+                for movie_id, _, popularity, synced_at in self.mirror.synced_since(since)]
+
+    def _row(self, movie: dict) -> Tuple:
+        cast = (movie.get('credits') or {}).get('cast') or ()
+        return movie['id'], movie.get('popularity'), frozenset(actor['id'] for actor in cast)
+
+    def load(self, rows: Iterable[Tuple]):
+        self.update(rows)
+
+    def update(self, rows: Iterable[Tuple]):
+        with self._lock:
+            for movie_id, popularity, cast in rows:
+                old = self._cast.get(movie_id, frozenset())
+                for actor_id in old - cast:
+                    postings = self._postings[actor_id]
+                    del postings[postings.index(movie_id)]
+                    if not postings:
+                        del self._postings[actor_id]
+                for actor_id in cast - old:
+                    self._postings.setdefault(actor_id, array('q')).append(movie_id)
+                self._cast[movie_id] = cast
+                self._popularity[movie_id] = popularity or 0.0
+
+    def page(self, cast: Iterable[int], page: int, per_page: int, excluded=frozenset()) -> Tuple[List[int], int]:
+        """
+        Get a page of the movies sharing cast members with the given cast, the movies sharing the most cast members
+        first and the most popular first among those.
+
+        :param cast: The actor identifiers.
+        :param page: The page number.
+        :param per_page: The number of movies per page.
+        :param excluded: Movies to leave out, e.g. the deleted movies.
+        :return: The movie identifiers of the page and the total number of movies sharing cast members.
+        """
+        self._refresh_if_due()
+        with self._lock:
+            shared = Counter()
+            for actor_id in frozenset(cast):
+                shared.update(self._postings.get(actor_id, ()))
+            if excluded:
+                for movie_id in [movie_id for movie_id in shared if movie_id in excluded]:
+                    del shared[movie_id]
+            popularity = self._popularity
+            ranked = heapq.nsmallest(page * per_page, shared,
+                                     key=lambda movie_id: (-shared[movie_id], -popularity[movie_id]))
+        return ranked[(page - 1) * per_page:], len(shared)
+
+
+# Actor index of this worker.
+actor_index = ActorIndex()
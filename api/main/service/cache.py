@@ -0,0 +1,380 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+# States of a cache lookup.
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+
+class CacheEntry:
+    """
+    A cached upstream response body together with its freshness bookkeeping and the validators of the upstream
+    response, used to revalidate the entry with a conditional request.
+    """
+    __slots__ = ('body', 'stored_at', 'ttl', 'stale_ttl', 'etag', 'last_modified')
+
+    def __init__(self, body: bytes, ttl: float, stale_ttl: float, stored_at: Optional[float] = None,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.body = body
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stored_at = time.time() if stored_at is None else stored_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def validators(self) -> Dict[str, str]:
+        """
+        Get the headers of a conditional request revalidating the entry.
+
+        :return: The `If-None-Match` and `If-Modified-Since` headers, empty if upstream sent no validators.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    def state(self, now: float) -> str:
+        """
+        Get the freshness state of the entry.
+
+        :param now: The current timestamp.
+        :return: `FRESH` within the ttl, `STALE` within the stale window after it and `MISS` once fully expired.
+        """
+        age = now - self.stored_at
+        if age < self.ttl:
+            return FRESH
+        if age < self.ttl + self.stale_ttl:
+            return STALE
+        return MISS
+
+
+class CachePolicy:
+    """
+    Time to live settings for the upstream paths matching `pattern`.
+    """
+    __slots__ = ('pattern', 'ttl', 'stale_ttl')
+
+    def __init__(self, pattern: str, ttl: float, stale_ttl: float = 0):
+        self.pattern = re.compile(pattern)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+
+class CacheBackend(ABC):
+    """
+    Storage interface of the response cache. Backends only store entries, freshness is decided by `ResponseCache`.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        """
+        Delete all entries whose key starts with the given prefix.
+        """
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Process local backend evicting entries in least recently used order once either `max_entries` or `max_bytes` is
+    exceeded.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str):
+        self._bytes -= self._entries.pop(key).size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'evictions': self.evictions}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Backend stored in a local SQLite file, shared by all worker processes on the same host.
+
+    The database runs in WAL mode so readers never block the writer. Once `max_entries` is exceeded the oldest
+    entries are evicted first.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, table: str = 'entries'):
+        self.path = path
+        self.max_entries = max_entries
+        # Caches sharing the file keep their entries, and their eviction, apart in a table each.
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        self.evictions = 0
+        with self._connection() as connection:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                'key TEXT PRIMARY KEY, body BLOB NOT NULL, stored_at REAL NOT NULL, '
+                'ttl REAL NOT NULL, stale_ttl REAL NOT NULL)'
+            )
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_stored_at ON {table} (stored_at)')
+            # Caches created before the validators were stored.
+            columns = {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}
+            for column in ('etag', 'last_modified'):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, connections can't be shared between threads.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        row = self._connection().execute(
+            f'SELECT body, ttl, stale_ttl, stored_at, etag, last_modified FROM {self.table} WHERE key = ?', (key,)
+        ).fetchone()
+        return None if row is None else CacheEntry(*row)
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._connection() as connection:
+            connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, body, stored_at, ttl, stale_ttl, etag, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, entry.body, entry.stored_at, entry.ttl, entry.stale_ttl, entry.etag, entry.last_modified),
+            )
+            # Only check the size of the table every now and then, counting rows isn't free.
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection):
+        overflow = connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            connection.execute(
+                f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY stored_at LIMIT ?)',
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def delete(self, key: str):
+        with self._connection() as connection:
+            connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix: str):
+        # A range over the primary key rather than LIKE, which can't use the index.
+        with self._connection() as connection:
+            connection.execute(f'DELETE FROM {self.table} WHERE key >= ? AND key < ?',
+                               (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute(f'DELETE FROM {self.table}')
+
+    def stats(self) -> Dict[str, int]:
+        entries, size = self._connection().execute(
+            f'SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM {self.table}'
+        ).fetchone()
+        return {'entries': entries, 'bytes': size, 'evictions': self.evictions}
+
+
+def create_backend(config, name: str = 'TMDB', table: str = 'entries') -> CacheBackend:
+    """
+    Create the cache backend selected by the `CACHE_BACKEND` setting of the given configuration.
+
+    Every cache has a backend of its own, limited by its `<name>_CACHE_MAX_ENTRIES` and `<name>_CACHE_MAX_BYTES`
+    settings and stored in its own table of the SQLite file.
+
+    :param config: The Flask application configuration.
+    :param name: The settings prefix of the cache, e.g. 'TMDB'.
+    :param table: The table of the entries in the SQLite file.
+    :return: The cache backend.
+    """
+    backend = config['CACHE_BACKEND']
+    max_entries = config[f'{name}_CACHE_MAX_ENTRIES']
+    if backend == 'memory':
+        return MemoryBackend(max_entries=max_entries, max_bytes=config[f'{name}_CACHE_MAX_BYTES'])
+    if backend == 'sqlite':
+        return SQLiteBackend(config['CACHE_SQLITE_PATH'], max_entries=max_entries, table=table)
+    raise ValueError(f'Unknown cache backend {backend}.')
+
+
+class ResponseCache:
+    """
+    Cache for upstream response bodies on top of a `CacheBackend`.
+
+    Every upstream path gets its ttl from the first matching `CachePolicy`, paths without a policy are never cached.
+    Expired entries are still served during their stale window so callers can revalidate them in the background.
+    """
+
+    def __init__(self, policies: Iterable[Tuple[str, float, float]] = (), backend: Optional[CacheBackend] = None):
+        self.policies = [CachePolicy(*policy) for policy in policies]
+        self.backend = backend or MemoryBackend()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path: str, params: Optional[dict] = None) -> str:
+        """
+        Build the cache key of an upstream call from its path and query params.
+
+        :param path: The upstream path.
+        :param params: The call specific query params.
+        :return: The cache key.
+        """
+        if not params:
+            return path
+        return path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(params.items()))
+
+    def policy(self, path: str) -> Optional[CachePolicy]:
+        """
+        Get the policy of the given upstream path.
+
+        :param path: The upstream path.
+        :return: The first matching policy or None if the path must not be cached.
+        """
+        path = path.strip('/')
+        for policy in self.policies:
+            if policy.pattern.fullmatch(path):
+                return policy
+        return None
+
+    def get(self, key: str) -> Tuple[Optional[CacheEntry], str]:
+        """
+        Look up an entry.
+
+        :param key: The cache key.
+        :return: The entry, or None on a miss, and its state.
+        """
+        entry = self.backend.get(key)
+        state = MISS if entry is None else entry.state(time.time())
+        with self._lock:
+            if state == FRESH:
+                self.hits += 1
+            elif state == STALE:
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+        if state == MISS:
+            if entry is not None:
+                self.backend.delete(key)
+            return None, MISS
+        return entry, state
+
+    def set(self, key: str, body: bytes, policy: CachePolicy, etag: Optional[str] = None,
+            last_modified: Optional[str] = None):
+        """
+        Store a response body under the given key.
+
+        :param key: The cache key.
+        :param body: The raw response body.
+        :param policy: The policy providing the ttl of the entry.
+        :param etag: The `ETag` header of the upstream response.
+        :param last_modified: The `Last-Modified` header of the upstream response.
+        """
+        self.backend.set(key, CacheEntry(body, policy.ttl, policy.stale_ttl, etag=etag, last_modified=last_modified))
+
+    def revalidated(self, key: str, entry: CacheEntry, policy: CachePolicy):
+        """
+        Store an entry again as fresh after upstream confirmed it is unchanged.
+
+        :param key: The cache key.
+        :param entry: The revalidated entry.
+        :param policy: The policy providing the ttl of the entry.
+        """
+        self.backend.set(key, CacheEntry(entry.body, policy.ttl, policy.stale_ttl, etag=entry.etag,
+                                         last_modified=entry.last_modified))
+
+    def delete(self, key: str):
+        self.backend.delete(key)
+
+    def delete_prefix(self, prefix: str):
+        self.backend.delete_prefix(prefix)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the cache.
+
+        :return: A dictionary with the hit, stale hit and miss counters of this worker and the backend usage.
+        """
+        with self._lock:
+            stats = {'hits': self.hits, 'stale_hits': self.stale_hits, 'misses': self.misses}
+        return stats | self.backend.stats()
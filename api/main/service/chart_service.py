@@ -0,0 +1,117 @@
+import hashlib
+import json
+from typing import Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from .cache import CachePolicy, ResponseCache, create_backend
+
+# Layout of the bar charts in pixels: one row per bar, labels left of the bars.
+ROW_HEIGHT = 24
+LABEL_WIDTH = 220
+BAR_WIDTH = 320
+WIDTH = LABEL_WIDTH + BAR_WIDTH + 60
+TOP = 36
+BOTTOM = 24
+# Labels longer than this many characters are cut short, the full label is shown on hover.
+LABEL_LENGTH = 32
+BAR_COLOR = '#3b82f6'
+GRID_COLOR = '#e5e7eb'
+TEXT_COLOR = '#6b7280'
+
+
+def _truncate(label: str) -> str:
+    return label if len(label) <= LABEL_LENGTH else label[:LABEL_LENGTH - 1] + '…'
+
+
+def render_bar_chart(title: str, labels: Sequence[str], values: Sequence[float], maximum: float = 10) -> str:
+    """
+    Render a horizontal bar chart as a standalone SVG document.
+
+    :param title: The title above the chart.
+    :param labels: The label of every bar.
+    :param values: The value of every bar, clamped to [0, maximum].
+    :param maximum: The value of a full bar.
+    :return: The SVG document.
+    """
+    bottom = TOP + ROW_HEIGHT * len(values)
+    height = bottom + BOTTOM
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{height}" viewBox="0 0 {WIDTH} {height}" '
+        f'font-family="sans-serif" font-size="12">',
+        '<rect width="100%" height="100%" fill="#fff"/>',
+        f'<text x="{WIDTH / 2:g}" y="22" text-anchor="middle" font-size="16" font-weight="bold">{escape(title)}</text>',
+    ]
+    for tick in range(0, int(maximum) + 1, 2):
+        x = LABEL_WIDTH + BAR_WIDTH * tick / maximum
+        parts.append(f'<line x1="{x:.1f}" y1="{TOP}" x2="{x:.1f}" y2="{bottom}" stroke="{GRID_COLOR}"/>')
+        parts.append(f'<text x="{x:.1f}" y="{bottom + 16}" text-anchor="middle" fill="{TEXT_COLOR}">{tick}</text>')
+    for row, (label, value) in enumerate(zip(labels, values)):
+        y = TOP + row * ROW_HEIGHT
+        width = BAR_WIDTH * max(0.0, min(value, maximum)) / maximum
+        parts.append(
+            f'<g><title>{escape(label)}: {value:.1f}</title>'
+            f'<text x="{LABEL_WIDTH - 8}" y="{y + ROW_HEIGHT / 2 + 4:g}" text-anchor="end">{escape(_truncate(label))}'
+            f'</text><rect x="{LABEL_WIDTH}" y="{y + 4}" width="{width:.1f}" height="{ROW_HEIGHT - 8}" '
+            f'fill="{BAR_COLOR}"/><text x="{LABEL_WIDTH + width + 4:.1f}" y="{y + ROW_HEIGHT / 2 + 4:g}" '
+            f'fill="{TEXT_COLOR}">{value:.1f}</text></g>'
+        )
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+class ChartCache:
+    """
+    Charts rendered locally as SVG, cached by a hash of their contents.
+
+    A chart is only rendered the first time its contents are seen, so repeated comparisons of the same movies are
+    served from the cache. The charts are stored in the configured cache backend, so a chart rendered by one worker
+    can be served by the others. Entries may expire or be evicted, callers rebuild a missing chart from its data.
+    """
+
+    def __init__(self):
+        self.cache: ResponseCache = ResponseCache()
+        self.policy = CachePolicy('chart', 7 * 24 * 60 * 60)
+
+    def init_app(self, app):
+        """
+        Configure the cache from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.cache = ResponseCache(backend=create_backend(app.config, 'CHART', 'chart_entries'))
+        self.policy = CachePolicy('chart', app.config['CHART_CACHE_TTL'])
+
+    @staticmethod
+    def key(title: str, labels: Sequence[str], values: Sequence[float]) -> str:
+        """
+        Get the content hash of a chart.
+        """
+        contents = json.dumps([title, list(labels), [float(value) for value in values]], separators=(',', ':'))
+        return hashlib.sha256(contents.encode()).hexdigest()[:32]
+
+    def bar_chart(self, title: str, labels: Sequence[str], values: Sequence[float]) -> Tuple[str, bytes]:
+        """
+        Render a bar chart unless it is cached already, see `render_bar_chart`.
+
+        :return: The content hash of the chart and the SVG document.
+        """
+        chart_hash = self.key(title, labels, values)
+        entry, _ = self.cache.get('chart/' + chart_hash)
+        if entry is not None:
+            return chart_hash, entry.body
+        chart = render_bar_chart(title, labels, values).encode()
+        self.cache.set('chart/' + chart_hash, chart, self.policy)
+        return chart_hash, chart
+
+    def get(self, chart_hash: str) -> Optional[bytes]:
+        """
+        Get a rendered chart by its content hash.
+
+        :return: The SVG document, None if it isn't cached (anymore).
+        """
+        entry, _ = self.cache.get('chart/' + chart_hash)
+        return None if entry is None else entry.body
+
+
+# Chart cache of this worker.
+charts = ChartCache()
@@ -0,0 +1,236 @@
+import heapq
+import re
+from array import array
+from fractions import Fraction
+from typing import AbstractSet, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .mirror_index import MirrorIndex
+
+# Rankings of the movies similar in genre: movies with exactly the same genres, or all movies sharing a genre ordered
+# by the Jaccard similarity of their genres.
+RANKINGS = ('exact', 'jaccard')
+
+_NONZERO_BYTE = re.compile(rb'[^\x00]')
+
+
+def members(bitmap: int) -> List[int]:
+    """
+    Get the positions of the set bits of a bitmap, in ascending order.
+    """
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    positions = []
+    for match in _NONZERO_BYTE.finditer(data):
+        base = match.start() * 8
+        byte = data[match.start()]
+        while byte:
+            low = byte & -byte
+            positions.append(base + low.bit_length() - 1)
+            byte ^= low
+    return positions
+
+
+def popcount(bitmap: int) -> int:
+    return bin(bitmap).count('1')
+
+
+def bit_sliced_sum(bitmaps: Iterable[int]) -> List[int]:
+    """
+    Count for every position how many of the bitmaps have its bit set, for all positions at once.
+
+    :param bitmaps: The bitmaps.
+    :return: The counts as bit planes, least significant first: plane i holds bit i of the count of every position.
+    """
+    planes: List[int] = []
+    for bitmap in bitmaps:
+        carry, i = bitmap, 0
+        while carry:
+            if i == len(planes):
+                planes.append(carry)
+                break
+            planes[i], carry = planes[i] ^ carry, planes[i] & carry
+            i += 1
+    return planes
+
+
+def equal_to(planes: List[int], count: int, universe: int) -> int:
+    """
+    Get the bitmap of the positions of `universe` whose count in the bit planes of `bit_sliced_sum` equals `count`.
+    """
+    if count >> len(planes):
+        return 0
+    bitmap = universe
+    for i, plane in enumerate(planes):
+        bitmap &= plane if count >> i & 1 else ~plane
+    return bitmap
+
+
+class GenreIndex(MirrorIndex):
+    """
+    Inverted index of the mirrored movies from genre to movies.
+
+    Every movie gets a position and every genre a bitmap of the positions of its movies, held in a Python integer.
+    Set queries over the genres are bitwise operations on whole bitmaps: the movies with exactly the given genres are
+    the AND of their bitmaps without the OR of the other bitmaps. For the Jaccard ranking the number of shared genres
+    and the number of genres of all movies are counted at once by adding up bitmaps as bit planes.
+    """
+
+    def clear(self):
+        self._positions: Dict[int, int] = {}
+        # The movie ids, popularity and genres by position. Positions are only ever appended, so readers can use the
+        # arrays while they grow.
+        self._ids = array('q')
+        self._popularity = array('d')
+        self._genres: List[FrozenSet[int]] = []
+        # Writers replace the bitmaps as a whole.
+        self._bitmaps: Dict[int, int] = {}
+        self._size = 0
+        # The last excluded set seen by `page` and the mask clearing the positions of its indexed movies.
+        self._excluded: Optional[Tuple[AbstractSet[int], int]] = None
+
+    def size(self) -> int:
+        return self._size
+
+    def _read(self, since: float) -> List[Tuple]:
+        genres = self.mirror.genres_since(since)
+        return [(movie_id, popularity, frozenset(genres.get(movie_id, ())), synced_at)
+                for movie_id, _, popularity, synced_at in self.mirror.synced_since(since)]
+
+    def _row(self, movie: dict) -> Tuple:
+        return movie['id'], movie.get('popularity'), frozenset(genre['id'] for genre in movie.get('genres') or ())
+
+    def _position(self, movie_id: int) -> int:
+        position = self._positions.get(movie_id)
+        if position is None:
+            if self._excluded is not None and movie_id in self._excluded[0]:
+                self._excluded = None
+            position = self._positions[movie_id] = len(self._ids)
+            self._ids.append(movie_id)
+            self._popularity.append(0.0)
+            self._genres.append(frozenset())
+        return position
+
+    def load(self, rows: Iterable[Tuple]):
+        with self._lock:
+            for movie_id, popularity, genre_ids in rows:
+                position = self._position(movie_id)
+                self._popularity[position] = popularity or 0.0
+                self._genres[position] = genre_ids
+
+            buffers: Dict[int, bytearray] = {}
+            size = len(self._ids)
+            for position, genre_ids in enumerate(self._genres):
+                for genre_id in genre_ids:
+                    buffer = buffers.get(genre_id)
+                    if buffer is None:
+                        buffer = buffers[genre_id] = bytearray((size + 7) // 8)
+                    buffer[position >> 3] |= 1 << (position & 7)
+            self._bitmaps = {genre_id: int.from_bytes(buffer, 'little') for genre_id, buffer in buffers.items()}
+            self._size = size
+
+    def update(self, rows: Iterable[Tuple]):
+        with self._lock:
+            bitmaps = dict(self._bitmaps)
+            for movie_id, popularity, genre_ids in rows:
+                position = self._position(movie_id)
+                self._popularity[position] = popularity or 0.0
+                bit = 1 << position
+                for genre_id in self._genres[position] - genre_ids:
+                    bitmaps[genre_id] &= ~bit
+                for genre_id in genre_ids - self._genres[position]:
+                    bitmaps[genre_id] = bitmaps.get(genre_id, 0) | bit
+                self._genres[position] = genre_ids
+            self._bitmaps = bitmaps
+            self._size = len(self._ids)
+
+    def _snapshot(self) -> Tuple[Dict[int, int], int]:
+        self._refresh_if_due()
+        with self._lock:
+            return self._bitmaps, (1 << self._size) - 1
+
+    def exact(self, genre_ids: Iterable[int]) -> int:
+        """
+        Get the bitmap of the movies with exactly the given genres.
+        """
+        genre_ids = frozenset(genre_ids)
+        bitmaps, universe = self._snapshot()
+        if not genre_ids <= bitmaps.keys():
+            return 0
+        bitmap = universe
+        for genre_id, genre_bitmap in bitmaps.items():
+            bitmap &= genre_bitmap if genre_id in genre_ids else ~genre_bitmap
+        return bitmap
+
+    def jaccard(self, genre_ids: Iterable[int]) -> List[int]:
+        """
+        Get the movies sharing a genre with the given genres, grouped by the Jaccard similarity of their genres.
+
+        Movies without genres only match an empty set of genres.
+
+        :param genre_ids: The genre identifiers.
+        :return: The bitmaps of the groups of movies with the same similarity, most similar first.
+        """
+        genre_ids = frozenset(genre_ids)
+        if not genre_ids:
+            return [self.exact(genre_ids)]
+        bitmaps, universe = self._snapshot()
+        shared = bit_sliced_sum(bitmaps[genre_id] for genre_id in genre_ids if genre_id in bitmaps)
+        counts = bit_sliced_sum(bitmaps.values())
+
+        groups: Dict[Fraction, int] = {}
+        for common in range(1, len(genre_ids) + 1):
+            sharing = equal_to(shared, common, universe)
+            if not sharing:
+                continue
+            for count in range(common, 1 << len(counts)):
+                bitmap = equal_to(counts, count, sharing)
+                if bitmap:
+                    similarity = Fraction(common, len(genre_ids) + count - common)
+                    groups[similarity] = groups.get(similarity, 0) | bitmap
+        return [groups[similarity] for similarity in sorted(groups, reverse=True)]
+
+    def page(self, groups: List[int], page: int, per_page: int, excluded=frozenset()) -> Tuple[List[int], int]:
+        """
+        Get a page of the movies in the given groups, group by group and most popular first within a group.
+
+        Only the movies of the groups overlapping the page are looked at, the others are skipped by their count. The
+        excluded movies are cleared with a mask, which is only built again when the excluded set is replaced or one of
+        its movies is indexed.
+
+        :param groups: The bitmaps of the groups, see `exact` and `jaccard`.
+        :param page: The page number.
+        :param per_page: The number of movies per page.
+        :param excluded: Movies to leave out, e.g. the deleted movies.
+        :return: The movie identifiers of the page and the total number of movies in the groups.
+        """
+        if excluded:
+            mask = self._mask(excluded)
+            groups = [bitmap & mask for bitmap in groups]
+
+        counts = [popcount(bitmap) for bitmap in groups]
+        start, end = (page - 1) * per_page, page * per_page
+        movie_ids = []
+        for bitmap, count in zip(groups, counts):
+            if start < count:
+                popularity = self._popularity
+                ranked = heapq.nsmallest(end, members(bitmap), key=lambda position: -popularity[position])
+                movie_ids += [self._ids[position] for position in ranked[start:end]]
+            start, end = max(0, start - count), end - count
+            if end <= 0:
+                break
+        return movie_ids, sum(counts)
+
+    def _mask(self, excluded: AbstractSet[int]) -> int:
+        memo = self._excluded
+        if memo is None or memo[0] is not excluded:
+            # Under the lock, so a concurrent update can't index an excluded movie while the mask is built.
+            with self._lock:
+                positions = [position for position in map(self._positions.get, excluded) if position is not None]
+                buffer = bytearray((max(positions, default=0) + 8) // 8)
+                for position in positions:
+                    buffer[position >> 3] |= 1 << (position & 7)
+                memo = self._excluded = (excluded, ~int.from_bytes(buffer, 'little'))
+        return memo[1]
+
+
+# Genre index of this worker.
+genre_index = GenreIndex()
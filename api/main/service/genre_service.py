@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List
+
+from . import mirror_service
+
+
+class GenreRegistry:
+    """
+    In-memory catalogue of the movie genres of The Movie Database.
+
+    The genre list is loaded lazily on first use and refreshed in the background every `refresh_interval` seconds.
+    Every genre gets a stable bit, so a set of genres can be represented as an integer bitmask.
+    """
+
+    def __init__(self, refresh_interval: float = 24 * 60 * 60):
+        self.refresh_interval = refresh_interval
+        self._names: Dict[int, str] = {}
+        self._bits: Dict[int, int] = {}
+        self._ids: FrozenSet[int] = frozenset()
+        self._all_mask: int = 0
+        self.loaded_at: float = 0
+        self._lock = threading.Lock()
+        self._refresher: threading.Thread = None
+
+    def init_app(self, app):
+        """
+        Configure the registry from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.refresh_interval = app.config['GENRES_REFRESH_INTERVAL']
+
+    def load(self) -> bool:
+        """
+        (Re)load the genre list from the mirror or the upstream, the previous list is kept when both fail.
+
+        :return: Whether the genre list was loaded.
+        """
+        status, body = mirror_service.get_list('genre/movie/list')
+        if status != 200:
+            return False
+        with self._lock:
+            names = {genre['id']: genre['name'] for genre in body['genres']}
+            bits = dict(self._bits)
+            for genre_id in names:
+                bits.setdefault(genre_id, 1 << len(bits))
+            self._names = names
+            self._bits = bits
+            self._ids = frozenset(names)
+            self._all_mask = self._mask(names)
+            self.loaded_at = time.time()
+        return True
+
+    def _ensure_loaded(self):
+        """
+        Load the genre list on first use and start the background refresher.
+        """
+        if self.loaded_at:
+            return
+        self.load()
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh, name='genre-refresh', daemon=True)
+                self._refresher.start()
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.load()
+
+    def _mask(self, genre_ids: Iterable[int]) -> int:
+        mask = 0
+        for genre_id in genre_ids:
+            mask |= self._bits.get(genre_id, 0)
+        return mask
+
+    @property
+    def ids(self) -> FrozenSet[int]:
+        """
+        The identifiers of all genres.
+        """
+        self._ensure_loaded()
+        return self._ids
+
+    @property
+    def names(self) -> Dict[int, str]:
+        """
+        The names of all genres by their identifier.
+        """
+        self._ensure_loaded()
+        return self._names
+
+    @property
+    def all_mask(self) -> int:
+        """
+        The bitmask of all genres.
+        """
+        self._ensure_loaded()
+        return self._all_mask
+
+    def bit(self, genre_id: int) -> int:
+        """
+        Get the bit of a genre, 0 for unknown genres.
+        """
+        self._ensure_loaded()
+        return self._bits.get(genre_id, 0)
+
+    def mask(self, genre_ids: Iterable[int]) -> int:
+        """
+        Get the bitmask of a set of genres, unknown genres are ignored.
+
+        :param genre_ids: The genre identifiers.
+        :return: The bitmask.
+        """
+        self._ensure_loaded()
+        return self._mask(genre_ids)
+
+    def ids_of(self, mask: int) -> List[int]:
+        """
+        Get the genres in a bitmask.
+
+        :param mask: The bitmask.
+        :return: The genre identifiers, in the order of the upstream genre list.
+        """
+        self._ensure_loaded()
+        return [genre_id for genre_id in self._names if self._bits[genre_id] & mask]
+
+    def complement(self, genre_ids: Iterable[int]) -> List[int]:
+        """
+        Get all genres that are not in the given set of genres.
+
+        :param genre_ids: The genre identifiers.
+        :return: The genre identifiers of all other genres.
+        """
+        return self.ids_of(self.all_mask & ~self.mask(genre_ids))
+
+
+# Registry shared by all controllers of this worker.
+genres = GenreRegistry()
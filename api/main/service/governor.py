@@ -0,0 +1,383 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from email.utils import parsedate_to_datetime
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+import requests
+
+R = TypeVar('R')
+
+# Priority lanes of the upstream calls, a lower lane goes first: calls of interactive requests such as movie details,
+# the concurrent calls of fan-out requests such as the popular pages and background calls such as cache refreshes.
+INTERACTIVE, FANOUT, BACKGROUND = 0, 1, 2
+LANES = ('interactive', 'fanout', 'background')
+
+# Longest a waiting coroutine sleeps before checking whether it is at the head of the queue.
+ASYNC_POLL_INTERVAL = 0.01
+
+_lane: contextvars.ContextVar = contextvars.ContextVar('upstream_lane', default=INTERACTIVE)
+
+
+class Throttled(requests.RequestException):
+    """
+    An upstream call couldn't get a token before its deadline, it is handled like any other failed upstream call.
+    Requests failing with it are answered with 503 and a `Retry-After` of `retry_after` seconds.
+    """
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def current_lane() -> int:
+    """
+    Get the lane of the upstream calls of the current context.
+    """
+    return _lane.get()
+
+
+@contextlib.contextmanager
+def lane(priority: int):
+    """
+    Run the upstream calls of the block in the given lane, or in the lane of the context if that one is lower.
+    """
+    token = _lane.set(max(_lane.get(), priority))
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def in_lane(priority: int, func: Callable[..., R], *args) -> R:
+    """
+    Call `func` in the given lane, see `lane`.
+    """
+    with lane(priority):
+        return func(*args)
+
+
+def retry_after(response) -> Optional[float]:
+    """
+    Get the delay in seconds requested by the `Retry-After` header of a response, None if it has none.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class TokenBucket(ABC):
+    """
+    Token bucket holding up to `burst` tokens, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+    @abstractmethod
+    def take(self, reserve: float = 0) -> float:
+        """
+        Take a token, unless that would leave fewer than `reserve` tokens.
+
+        :param reserve: The number of tokens to leave for others.
+        :return: 0 when a token was taken, otherwise the number of seconds until one can be taken.
+        """
+
+    @abstractmethod
+    def block(self, seconds: float):
+        """
+        Don't hand out tokens for the given number of seconds, e.g. when the upstream asks to retry later.
+        """
+
+    @abstractmethod
+    def available(self) -> float:
+        """
+        Get the number of tokens in the bucket.
+        """
+
+    def _take(self, tokens: float, updated_at: float, blocked_until: float, reserve: float,
+              now: float) -> Tuple[float, float]:
+        """
+        Refill the tokens since `updated_at` and take one.
+
+        :return: The tokens left and the seconds to wait, 0 when the token was taken.
+        """
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if now < blocked_until:
+            return tokens, blocked_until - now
+        if tokens - 1 < reserve:
+            return tokens, (reserve + 1 - tokens) / self.rate
+        return tokens - 1, 0.0
+
+
+class LocalBucket(TokenBucket):
+    """
+    Bucket of a single worker.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__(rate, burst)
+        self._tokens = float(burst)
+        self._updated_at = time.time()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, reserve: float = 0) -> float:
+        with self._lock:
+            now = time.time()
+            self._tokens, wait = self._take(self._tokens, self._updated_at, self._blocked_until, reserve, now)
+            self._updated_at = now
+            return wait
+
+    def block(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+
+    def available(self) -> float:
+        with self._lock:
+            return min(self.burst, self._tokens + (time.time() - self._updated_at) * self.rate)
+
+
+class SQLiteBucket(TokenBucket):
+    """
+    Bucket stored in a local SQLite file, shared by all worker processes on the same host.
+    """
+
+    def __init__(self, rate: float, burst: int, path: str):
+        super().__init__(rate, burst)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL)'
+            )
+            connection.execute('INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, 0)', ('tmdb', burst, time.time()))
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection of the current thread, connections can't be shared between threads.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Transactions are started explicitly, so the read and the update of the bucket are atomic.
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def take(self, reserve: float = 0) -> float:
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            tokens, updated_at, blocked_until = connection.execute(
+                "SELECT tokens, updated_at, blocked_until FROM buckets WHERE name = 'tmdb'").fetchone()
+            now = time.time()
+            tokens, wait = self._take(tokens, updated_at, blocked_until, reserve, now)
+            connection.execute("UPDATE buckets SET tokens = ?, updated_at = ? WHERE name = 'tmdb'", (tokens, now))
+        finally:
+            connection.execute('COMMIT')
+        return wait
+
+    def block(self, seconds: float):
+        self._connection().execute(
+            "UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE name = 'tmdb'", (time.time() + seconds,))
+
+    def available(self) -> float:
+        tokens, updated_at = self._connection().execute(
+            "SELECT tokens, updated_at FROM buckets WHERE name = 'tmdb'").fetchone()
+        return min(self.burst, tokens + (time.time() - updated_at) * self.rate)
+
+
+def create_bucket(config) -> Optional[TokenBucket]:
+    """
+    Create the bucket selected by the `TMDB_RATE_LIMIT_BACKEND` setting of the given configuration.
+
+    :param config: The Flask application configuration.
+    :return: The bucket, None when the rate isn't limited.
+    """
+    rate, burst, backend = config['TMDB_RATE_LIMIT'], config['TMDB_RATE_BURST'], config['TMDB_RATE_LIMIT_BACKEND']
+    if not rate:
+        return None
+    if backend == 'memory':
+        return LocalBucket(rate, burst)
+    if backend == 'sqlite':
+        return SQLiteBucket(rate, burst, config['TMDB_RATE_LIMIT_PATH'])
+    raise ValueError(f'Unknown rate limit backend {backend}.')
+
+
+class Governor:
+    """
+    Keeps the upstream calls under the rate limit of The Movie Database.
+
+    Every upstream call takes a token from a token bucket first. Calls waiting for a token queue in priority lanes,
+    only the call at the head of the queue may take a token, so interactive calls overtake fan-out calls and those
+    overtake background calls. Lower lanes also leave a share of the burst to the higher lanes, so a burst of
+    background work can't starve interactive calls. A call that can't get a token before the deadline of its lane is
+    given up with `Throttled`. When the upstream asks to retry later, no tokens are handed out until then.
+
+    The condition guarding the queue is never held while the bucket is used, a shared bucket may wait for a file
+    lock. Coroutines use the bucket on the default executor of the loop.
+    """
+
+    def __init__(self):
+        self.bucket: Optional[TokenBucket] = None
+        self.reserves: Tuple[float, ...] = (0, 0, 0)
+        self.deadlines: Tuple[float, ...] = (2, 5, 60)
+        self._queue: List[Tuple[int, int]] = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+        self.granted = [0] * len(LANES)
+        self.throttled = [0] * len(LANES)
+        self.waited = [0.0] * len(LANES)
+
+    def init_app(self, app):
+        """
+        Configure the governor from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.bucket = create_bucket(app.config)
+        if self.bucket is not None:
+            self.reserves = tuple(share * self.bucket.burst for share in app.config['TMDB_RATE_RESERVES'])
+        self.deadlines = tuple(app.config['TMDB_RATE_DEADLINES'])
+
+    def _enqueue(self, priority: int) -> Tuple[int, int]:
+        with self._condition:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._queue, ticket)
+            # The new call may have become the head of the queue.
+            self._condition.notify_all()
+            return ticket
+
+    def _dequeue(self, ticket: Tuple[int, int]):
+        with self._condition:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            # The next ticket may have become the head of the queue.
+            self._condition.notify_all()
+
+    def _is_head(self, ticket: Tuple[int, int]) -> bool:
+        with self._condition:
+            return self._queue[0] == ticket
+
+    def _granted(self, priority: int, start: float):
+        with self._condition:
+            self.granted[priority] += 1
+            self.waited[priority] += time.monotonic() - start
+
+    def _throttled(self, priority: int, wait: Optional[float]) -> Throttled:
+        with self._condition:
+            self.throttled[priority] += 1
+        return Throttled(f'No upstream call available within {self.deadlines[priority]}s.',
+                         max(wait or 0.0, 1 / self.bucket.rate))
+
+    def acquire(self):
+        """
+        Wait until an upstream call of the lane of the current context may be made.
+
+        :raises Throttled: If the deadline of the lane passes first.
+        """
+        if self.bucket is None:
+            return
+        priority = current_lane()
+        start = time.monotonic()
+        deadline = start + self.deadlines[priority]
+        ticket = self._enqueue(priority)
+        try:
+            wait = None
+            while True:
+                with self._condition:
+                    # Only the head of the queue may take a token.
+                    while self._queue[0] != ticket:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._throttled(priority, wait)
+                        self._condition.wait(remaining)
+                wait = self.bucket.take(self.reserves[priority])
+                if not wait:
+                    self._granted(priority, start)
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._throttled(priority, wait)
+                with self._condition:
+                    self._condition.wait(min(wait, remaining))
+        finally:
+            # Also when the bucket failed, a ticket left behind would block the queue.
+            self._dequeue(ticket)
+
+    async def acquire_async(self):
+        """
+        Non-blocking counterpart of `acquire`.
+        """
+        if self.bucket is None:
+            return
+        priority = current_lane()
+        start = time.monotonic()
+        deadline = start + self.deadlines[priority]
+        ticket = self._enqueue(priority)
+        try:
+            wait = None
+            while True:
+                if self._is_head(ticket):
+                    wait = await asyncio.to_thread(self.bucket.take, self.reserves[priority])
+                    if not wait:
+                        self._granted(priority, start)
+                        return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._throttled(priority, wait)
+                await asyncio.sleep(min(wait or ASYNC_POLL_INTERVAL, remaining))
+        finally:
+            # Also when the bucket failed or the coroutine was cancelled, a ticket left behind would block the queue.
+            self._dequeue(ticket)
+
+    def backoff(self, response) -> Optional[float]:
+        """
+        Stop handing out tokens for as long as an upstream response asks to retry later.
+
+        :param response: The upstream response.
+        :return: The delay the caller must wait itself before it retries: the delay requested by the `Retry-After`
+            header when the rate limit is disabled, 0 when the bucket waits it out for all calls, None if the
+            response requests no delay.
+        """
+        delay = retry_after(response) if response.status_code in (429, 503) else None
+        if delay and self.bucket is not None:
+            self.bucket.block(delay)
+            return 0.0
+        return delay
+
+    def collect(self):
+        """
+        Counters of the calls per lane and the available tokens, see `MetricsRegistry.register_collector`.
+        """
+        if self.bucket is None:
+            return
+        yield 'tmdb_governor_tokens', {}, self.bucket.available()
+        yield 'tmdb_governor_queued', {}, len(self._queue)
+        for priority, name in enumerate(LANES):
+            yield 'tmdb_governor_granted', {'lane': name}, self.granted[priority]
+            yield 'tmdb_governor_throttled', {'lane': name}, self.throttled[priority]
+            yield 'tmdb_governor_wait_seconds', {'lane': name}, self.waited[priority]
+
+
+# Governor of all upstream calls of this worker.
+governor = Governor()
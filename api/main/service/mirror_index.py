@@ -0,0 +1,110 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Tuple
+
+from ..model.movie_mirror import MovieMirror
+
+# Rows synced this long before the latest refresh are read again, writes of other workers may commit out of order.
+REFRESH_OVERLAP = 60
+
+
+class MirrorIndex(ABC):
+    """
+    In-memory index over the movies of the `MovieMirror`.
+
+    An index is bulk loaded from the mirror on first use and then refreshed incrementally with the movies synced since,
+    at most every `refresh_interval` seconds. Subclasses read their rows from the mirror in `_read` and index them in
+    `load` and `update`, every row starts with the movie id. Movies fetched by this worker are indexed right away with
+    `add`.
+    """
+
+    def __init__(self, mirror: Optional[MovieMirror] = None, refresh_interval: float = 5.0):
+        self.mirror = mirror
+        self.refresh_interval = refresh_interval
+        self._synced_at = 0.0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self.clear()
+
+    def init_app(self, app, mirror: MovieMirror):
+        """
+        Configure the index from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        :param mirror: The mirror the index is loaded from.
+        """
+        self.mirror = mirror
+        self.refresh_interval = app.config['MIRROR_INDEX_REFRESH_INTERVAL']
+        with self._lock:
+            self.clear()
+            self._synced_at = self._refreshed_at = 0.0
+
+    @abstractmethod
+    def clear(self):
+        """
+        Empty the index.
+        """
+
+    @abstractmethod
+    def size(self) -> int:
+        """
+        Get the number of indexed movies.
+        """
+
+    def __len__(self) -> int:
+        self._refresh_if_due()
+        return self.size()
+
+    @abstractmethod
+    def _read(self, since: float) -> List[Tuple]:
+        """
+        Read the rows of the movies synced after the given time, oldest first, with the time of the sync last.
+        """
+
+    @abstractmethod
+    def load(self, rows: Iterable[Tuple]):
+        """
+        Bulk load rows, replacing earlier rows of the same movies.
+        """
+
+    @abstractmethod
+    def update(self, rows: Iterable[Tuple]):
+        """
+        Index a small batch of rows, replacing earlier rows of the same movies.
+        """
+
+    @abstractmethod
+    def _row(self, movie: dict) -> Tuple:
+        """
+        Get the row of a movie from its details.
+        """
+
+    def add(self, movie: dict):
+        """
+        Index a movie that was just mirrored, without waiting for the next refresh.
+
+        :param movie: The movie details.
+        """
+        self.update([self._row(movie)])
+
+    def refresh(self):
+        """
+        Index the movies synced to the mirror since the last refresh, the first refresh bulk loads all movies.
+        """
+        if self.mirror is None:
+            return
+        self._refreshed_at = time.monotonic()
+        since = self._synced_at - REFRESH_OVERLAP if self._synced_at else 0.0
+        rows = self._read(since)
+        if not rows:
+            return
+        if self._synced_at:
+            self.update(row[:-1] for row in rows)
+        else:
+            self.load(row[:-1] for row in rows)
+        self._synced_at = max(self._synced_at, rows[-1][-1])
+
+    def _refresh_if_due(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
@@ -0,0 +1,250 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from typing import Any, Optional, Tuple
+
+from .actor_index import actor_index
+from .cache import ResponseCache
+from .genre_index import genre_index
+from .governor import BACKGROUND, lane
+from .runtime_index import runtime_index
+from .tmdb_async import tmdb_async
+from .tmdb_service import UPSTREAM_ERRORS, tmdb
+from ..model.movie_mirror import MovieMirror
+from ..util import metrics
+
+# Sub-resources retrieved together with the details of a movie, the mirror stores movies with them.
+MOVIE_DETAILS_PARAMS = {'append_to_response': 'credits'}
+
+# Mirror shared by all workers on this host. Everything written to it is fetched past the response cache: the mirror
+# records when a copy was synced, a cached response would be stored as fresh however old it is.
+mirror = MovieMirror()
+# In-memory indexes of the mirrored movies of this worker.
+indexes = (runtime_index, genre_index, actor_index)
+
+
+def _unavailable(status: int) -> bool:
+    """
+    Whether an upstream status means the upstream can't answer right now, rather than that the resource is missing.
+    """
+    return status == 429 or status >= 500
+
+
+def _movie_result(movie_id: int, status: int, movie: Any) -> Tuple[int, Any]:
+    """
+    Mirror a movie retrieved from the upstream, or fall back to the mirrored copy when the upstream is unavailable.
+    """
+    if status == 200:
+        mirror.put_movie(movie)
+        for index in indexes:
+            index.add(movie)
+    elif _unavailable(status):
+        stale = mirror.movie(movie_id, stale=True)
+        if stale is not None:
+            return 200, stale
+    return status, movie
+
+
+def _refresh_movie(movie_id: int):
+    """
+    Mirror a movie again from the upstream.
+    """
+    status, movie = tmdb.get_json(f'movie/{movie_id}', MOVIE_DETAILS_PARAMS, cached=False)
+    if status == 200:
+        _movie_result(movie_id, status, movie)
+
+
+def _serve_stale(movie_id: int, movie: dict) -> Tuple[int, Any]:
+    """
+    Serve a mirrored copy older than the max age of the mirror, while the movie is mirrored again in the background.
+    """
+    tmdb.refresh_in_background(f'mirror/movie/{movie_id}', lambda: _refresh_movie(movie_id))
+    return 200, movie
+
+
+def get_movie(movie_id: int) -> Tuple[int, Any]:
+    """
+    Retrieve the details of a movie together with its `credits`, from the mirror when it holds a copy and from the
+    upstream otherwise. Copies older than the max age of the mirror are served while they are refreshed in the
+    background.
+
+    :param movie_id: A movie identifier.
+    :return: The status and the movie details.
+    """
+    movie = mirror.movie(movie_id)
+    if movie is not None:
+        return 200, movie
+    movie = mirror.movie(movie_id, stale=True)
+    if movie is not None:
+        return _serve_stale(movie_id, movie)
+    status, movie = tmdb.get_json(f'movie/{movie_id}', MOVIE_DETAILS_PARAMS, cached=False)
+    return _movie_result(movie_id, status, movie)
+
+
+async def get_movie_async(movie_id: int) -> Tuple[int, Any]:
+    """
+    Non-blocking counterpart of `get_movie`, the mirror is read and written on the default executor of the loop.
+    """
+    movie = await asyncio.to_thread(mirror.movie, movie_id)
+    if movie is not None:
+        return 200, movie
+    movie = await asyncio.to_thread(mirror.movie, movie_id, stale=True)
+    if movie is not None:
+        return _serve_stale(movie_id, movie)
+    status, movie = await tmdb_async.get_json(f'movie/{movie_id}', MOVIE_DETAILS_PARAMS, cached=False)
+    return await asyncio.to_thread(_movie_result, movie_id, status, movie)
+
+
+def get_list(path: str, params: Optional[dict] = None) -> Tuple[int, Any]:
+    """
+    Retrieve a list such as a popular page or the genre list, from the mirror when it holds a recent copy and from
+    the upstream otherwise. While the upstream is unavailable older copies are served.
+
+    :param path: The upstream path.
+    :param params: The query params.
+    :return: The status and the body of the list.
+    """
+    key = ResponseCache.key(path, params)
+    body = mirror.list(key)
+    if body is not None:
+        return 200, body
+    try:
+        status, body = tmdb.get_json(path, params, cached=False)
+    except UPSTREAM_ERRORS:
+        body = mirror.list(key, stale=True)
+        if body is None:
+            raise
+        return 200, body
+    if status == 200:
+        mirror.put_list(key, body)
+    elif _unavailable(status):
+        stale = mirror.list(key, stale=True)
+        if stale is not None:
+            return 200, stale
+    return status, body
+
+
+class MirrorSync:
+    """
+    Background job keeping the mirror fresh by sweeping the popular pages, the details of the movies on them and the
+    genre list every `interval` seconds.
+
+    Every worker runs the job, a lease in the mirror makes sure only one of them sweeps at a time.
+    """
+
+    def __init__(self):
+        self.interval = 30 * 60
+        self.pages = 10
+        self.enabled = False
+        self.holder = f'{os.getpid()}-{uuid.uuid4().hex}'
+        self.last_sweep: dict = {}
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the job from the settings of the given Flask application and start it when enabled.
+
+        :param app: The Flask application instance.
+        """
+        self.interval = app.config['MIRROR_SYNC_INTERVAL']
+        self.pages = app.config['MIRROR_SYNC_PAGES']
+        self.enabled = app.config['MIRROR_SYNC']
+        metrics.registry.register_collector(self.collect)
+        if self.enabled:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mirror-sync', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # The lease outlives a sweep, the holder renews it on its next run.
+            if mirror.acquire('sync', self.holder, self.interval * 2):
+                try:
+                    with lane(BACKGROUND):
+                        self.sweep()
+                except Exception:
+                    # Try again on the next run, the mirror keeps serving what it has.
+                    pass
+            time.sleep(self.interval)
+
+    def sweep(self) -> dict:
+        """
+        Sync the genre list, the first `pages` popular pages and the details of their movies that are outdated.
+
+        A list or movie that can't be retrieved is counted as failed and left for the next sweep.
+
+        :return: The number of lists and movies that were synced and that failed.
+        """
+        started = time.time()
+        lists = failed = 0
+        status, body = self._get_json('genre/movie/list')
+        if status == 200:
+            mirror.put_list(ResponseCache.key('genre/movie/list'), body)
+            lists += 1
+        else:
+            failed += 1
+
+        movie_ids = []
+        pages = tmdb.map(lambda p: self._get_json('movie/popular', {'page': p}), range(1, self.pages + 1))
+        for page, (status, body) in enumerate(pages, 1):
+            if status == 200:
+                mirror.put_list(ResponseCache.key('movie/popular', {'page': page}), body)
+                movie_ids += [movie['id'] for movie in body['results']]
+                lists += 1
+            else:
+                failed += 1
+
+        # Movies are refreshed halfway their max age, so reads keep finding them fresh.
+        outdated = mirror.outdated(movie_ids, mirror.max_age / 2)
+        results = tmdb.map(lambda movie_id: self._get_json(f'movie/{movie_id}', MOVIE_DETAILS_PARAMS), outdated)
+        movies = [movie for status, movie in results if status == 200]
+        mirror.put_movies(movies)
+        failed += len(results) - len(movies)
+
+        self.last_sweep = {'lists': lists, 'movies': len(movies), 'failed': failed, 'duration': time.time() - started,
+                           'finished_at': time.time()}
+        return self.last_sweep
+
+    @staticmethod
+    def _get_json(path: str, params: Optional[dict] = None) -> Tuple[Optional[int], Any]:
+        """
+        Fetch a list or movie to mirror past the response cache, see `TMDBClient.get_json`.
+
+        :return: The status and the body, None for both if the upstream couldn't be reached.
+        """
+        try:
+            return tmdb.get_json(path, params, cached=False)
+        except UPSTREAM_ERRORS:
+            return None, None
+
+    def collect(self):
+        """
+        Gauges of the mirror and the latest sweep, see `MetricsRegistry.register_collector`.
+        """
+        for name, value in mirror.stats().items():
+            yield f'mirror_{name}', {}, value
+        for name, value in self.last_sweep.items():
+            yield f'mirror_sweep_{name}', {}, value
+
+
+# Sync job of this worker.
+mirror_sync = MirrorSync()
+
+
+def init_app(app):
+    """
+    Configure the mirror, its sync job and its indexes from the settings of the given Flask application.
+
+    :param app: The Flask application instance.
+    """
+    mirror.init_app(app)
+    for index in indexes:
+        index.init_app(app, mirror)
+    mirror_sync.init_app(app)
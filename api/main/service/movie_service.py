@@ -0,0 +1,288 @@
+import math
+from concurrent.futures import as_completed
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from flask import g, has_app_context
+
+from . import mirror_service
+from .actor_index import actor_index
+from .genre_index import genre_index
+from .genre_service import genres
+from .mirror_service import mirror
+from .runtime_index import runtime_index
+from .tmdb_service import UPSTREAM_ERRORS, tmdb
+from ..util.decoratorMovies import deletedMovies, paginate_filtered, remove_deleted_movies
+
+
+def get_movie(movie_id: int) -> Optional[dict]:
+    """
+    Retrieve the details of a movie, see `mirror_service.get_movie`.
+
+    :param movie_id: A movie identifier.
+    :raises UPSTREAM_ERRORS: If the upstream can't be reached and the movie isn't mirrored.
+    :return: The movie details, or None if the movie doesn't exist or has been deleted.
+    """
+    # The mirrored copy holds the credits as well, they are left out by the models of the details.
+    status, movie = mirror_service.get_movie(movie_id)
+    if status != 200 or movie['id'] in deletedMovies:
+        return None
+    return movie
+
+
+def _memoized() -> Optional[dict]:
+    """
+    Get the per request memo of the movie details, or None outside of a request.
+    """
+    return g.setdefault('movie_details', {}) if has_app_context() else None
+
+
+def get_movie_details(movie_id: int) -> Tuple[int, Any]:
+    """
+    Retrieve the details of a movie together with its `credits`, from the mirror or in a single upstream call.
+
+    The result is memoized for the current request, so every resource method handling the request shares one call.
+    Callers must not modify it.
+
+    :param movie_id: A movie identifier.
+    :return: The status and the movie details.
+    """
+    memo = _memoized()
+    if memo is not None and movie_id in memo:
+        return memo[movie_id]
+    result = mirror_service.get_movie(movie_id)
+    if memo is not None:
+        memo[movie_id] = result
+    return result
+
+
+async def get_movie_details_async(movie_id: int) -> Tuple[int, Any]:
+    """
+    Non-blocking counterpart of `get_movie_details`, sharing the same memo.
+    """
+    memo = _memoized()
+    if memo is not None and movie_id in memo:
+        return memo[movie_id]
+    result = await mirror_service.get_movie_async(movie_id)
+    if memo is not None:
+        memo[movie_id] = result
+    return result
+
+
+def get_movies(movie_ids: Iterable[int]) -> List[Optional[dict]]:
+    """
+    Retrieve the details of multiple movies concurrently, every distinct id is only fetched once.
+
+    :param movie_ids: The movie identifiers.
+    :return: The movie details in the order of the distinct ids, None for movies that don't exist.
+    """
+    # dict.fromkeys keeps the first occurrence of every id in order.
+    return tmdb.map(get_movie, dict.fromkeys(movie_ids))
+
+
+def stream_movie_details(movie_ids: Iterable[int]) -> Iterator[Tuple[int, int, Optional[dict]]]:
+    """
+    Retrieve the details of multiple movies concurrently, every movie is yielded as soon as it is retrieved and every
+    distinct id is only fetched once.
+
+    :param movie_ids: The movie identifiers.
+    :return: An iterator over the movie id, the status and the movie details (with its `credits`) of every movie, in
+        order of completion. The status is 404 for movies that don't exist or have been deleted and 502 for movies
+        that couldn't be retrieved, their details are None.
+    """
+    futures = {tmdb.submit(mirror_service.get_movie, movie_id): movie_id for movie_id in dict.fromkeys(movie_ids)}
+    try:
+        for future in as_completed(futures):
+            movie_id = futures[future]
+            try:
+                status, movie = future.result()
+            except UPSTREAM_ERRORS:
+                yield movie_id, 502, None
+                continue
+            if status != 200 or movie['id'] in deletedMovies:
+                yield movie_id, 404, None
+            else:
+                yield movie_id, 200, movie
+    finally:
+        # The client went away, don't fetch the movies that haven't been started yet.
+        for future in futures:
+            future.cancel()
+
+
+def get_popular_movies(amount: int, page: int = 1) -> Optional[Tuple[dict, Iterator[dict]]]:
+    """
+    Retrieve the `amount` most popular movies that haven't been deleted, starting at the given popular page.
+
+    The first page is fetched right away to learn the page size and count, all further pages that are needed are
+    fetched concurrently. Every page body is parsed once. When deleted movies make the result fall short, it is
+    backfilled from the following pages.
+
+    :param amount: The number of movies to retrieve.
+    :param page: The first popular page.
+    :return: The last page that is needed without its results and an iterator over the movies in order of
+        popularity, or None if the first page couldn't be retrieved. The page and totals of the former are updated
+        once the latter is exhausted.
+    """
+    first = get_popular_page(page)
+    if first is None:
+        return None
+
+    per_page: int = len(first['results'])
+    total_pages: int = min(first['total_results'] // per_page, first['total_pages']) if per_page else page
+    last: int = page
+    if per_page and amount > per_page:
+        last = max(page, min(total_pages, page + math.ceil(amount / per_page) - 1))
+
+    futures = [tmdb.submit(get_popular_page, p) for p in range(page + 1, last + 1)]
+    header = {'page': last, 'total_results': first['total_results'], 'total_pages': first['total_pages']}
+
+    def pages() -> Iterator[Tuple[int, Optional[dict]]]:
+        yield page, first
+        yield from zip(range(page + 1, last + 1), (future.result() for future in futures))
+        # Backfill the movies that were removed because they have been deleted.
+        for backfill in range(last + 1, total_pages + 1):
+            yield backfill, get_popular_page(backfill)
+
+    def movies() -> Iterator[dict]:
+        remaining = amount
+        removed = 0
+        for number, body in pages():
+            header['page'] = max(header['page'], number)
+            if body is not None:
+                removed += remove_deleted_movies(body['results'])
+                results = body['results'][:remaining]
+                remaining -= len(results)
+                yield from results
+            # Stop before the next page is fetched.
+            if remaining <= 0:
+                break
+        if removed:
+            header['total_results'] = max(0, header['total_results'] - removed)
+            header['total_pages'] = math.ceil(header['total_results'] / per_page)
+
+    return header, movies()
+
+
+def get_popular_page(page: int) -> Optional[dict]:
+    """
+    Retrieve a page of the popular movies, from the mirror when it holds a recent copy.
+
+    :param page: The page number.
+    :return: The body of the page, or None if it couldn't be retrieved.
+    """
+    status, body = mirror_service.get_list('movie/popular', {'page': page})
+    return body if status == 200 else None
+
+
+def get_page(path: str, params: dict) -> Optional[dict]:
+    """
+    Retrieve a page of a paginated upstream endpoint.
+
+    :param path: The upstream path.
+    :param params: The query params, including the page number.
+    :return: The body of the page, or None if it couldn't be retrieved.
+    """
+    status, body = tmdb.get_json(path, params)
+    return body if status == 200 else None
+
+
+def discover_movies(params: dict, page: int, per_page: int) -> Optional[dict]:
+    """
+    Discover movies matching the given filters, without the deleted movies.
+
+    :param params: The filter params of `/discover/movie`.
+    :param page: The page number.
+    :param per_page: The number of movies per page.
+    :return: The paginated movies, or None if they couldn't be retrieved.
+    """
+    return paginate_filtered(lambda upstream_page: get_page('discover/movie', params | {'page': upstream_page}),
+                             page, per_page)
+
+
+def _mirrored_page(movie_ids: List[int], total_results: int, page: int, per_page: int) -> dict:
+    """
+    Build a page of movies found in an index of the mirror, with the list representation of the mirrored movies.
+    """
+    summaries = mirror.summaries(movie_ids)
+    return {
+        'page': page,
+        'results': [summaries[movie_id] for movie_id in movie_ids if movie_id in summaries],
+        'total_results': total_results,
+        'total_pages': math.ceil(total_results / per_page),
+    }
+
+
+def similar_runtime_movies(runtime: int, page: int, per_page: int, min_movies: int) -> Optional[dict]:
+    """
+    Get the movies with a runtime of at most 10 minutes more or less than the given runtime, without the deleted
+    movies and most popular first.
+
+    The movies are looked up in the runtime index of the mirrored movies, as long as it holds fewer than `min_movies`
+    movies the index doesn't know enough movies and they are discovered upstream instead.
+
+    :param runtime: The runtime in minutes.
+    :param page: The page number.
+    :param per_page: The number of movies per page.
+    :param min_movies: The minimum number of indexed movies to answer from the index.
+    :return: The paginated movies, or None if they couldn't be retrieved.
+    """
+    low, high = runtime - 10, runtime + 10
+    if len(runtime_index) < min_movies:
+        return discover_movies({'with_runtime.lte': high, 'with_runtime.gte': low}, page, per_page)
+
+    movie_ids, total_results = runtime_index.page(low, high, page, per_page, deletedMovies.snapshot())
+    return _mirrored_page(movie_ids, total_results, page, per_page)
+
+
+def similar_genre_movies(genre_ids: List[int], page: int, per_page: int, min_movies: int,
+                         ranking: str = 'exact') -> Optional[dict]:
+    """
+    Get the movies similar in genre to the given genres, without the deleted movies.
+
+    With the 'exact' ranking these are the movies with exactly the same genres, most popular first. With the 'jaccard'
+    ranking these are all movies sharing a genre, most similar first. They are looked up in the genre index of the
+    mirrored movies, as long as it holds fewer than `min_movies` movies they are discovered upstream instead, the
+    movies sharing a genre then most popular first.
+
+    :param genre_ids: The genre identifiers.
+    :param page: The page number.
+    :param per_page: The number of movies per page.
+    :param min_movies: The minimum number of indexed movies to answer from the index.
+    :param ranking: The ranking, see `genre_index.RANKINGS`.
+    :return: The paginated movies, or None if they couldn't be retrieved.
+    """
+    if len(genre_index) < min_movies:
+        if ranking == 'jaccard':
+            # Movies with any of the genres.
+            params = {'with_genres': '|'.join(str(v) for v in genre_ids)}
+        else:
+            params = {
+                'with_genres': ','.join(str(v) for v in genre_ids),
+                # All genres that are not in the given genres.
+                'without_genres': ','.join(str(v) for v in genres.complement(genre_ids))
+            }
+        return discover_movies(params, page, per_page)
+
+    groups = genre_index.jaccard(genre_ids) if ranking == 'jaccard' else [genre_index.exact(genre_ids)]
+    movie_ids, total_results = genre_index.page(groups, page, per_page, deletedMovies.snapshot())
+    return _mirrored_page(movie_ids, total_results, page, per_page)
+
+
+def overlapping_actors_movies(cast: List[int], page: int, per_page: int, min_movies: int) -> Optional[dict]:
+    """
+    Get the movies sharing actors with the given cast, without the deleted movies.
+
+    The movies are looked up in the actor index of the mirrored movies across the whole cast, the movies sharing the
+    most actors first. As long as the index holds fewer than `min_movies` movies the index doesn't know enough movies,
+    the movies with both leading actors are discovered upstream instead.
+
+    :param cast: The actor identifiers, leading actors first.
+    :param page: The page number.
+    :param per_page: The number of movies per page.
+    :param min_movies: The minimum number of indexed movies to answer from the index.
+    :return: The paginated movies, or None if they couldn't be retrieved.
+    """
+    if len(actor_index) < min_movies:
+        return discover_movies({'with_cast': ','.join(str(v) for v in cast[:2])}, page, per_page)
+
+    movie_ids, total_results = actor_index.page(cast, page, per_page, deletedMovies.snapshot())
+    return _mirrored_page(movie_ids, total_results, page, per_page)
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .mirror_index import MirrorIndex
+
+
+def _run(popularity: array, ids: array, start: int, stop: int) -> Iterator[Tuple[float, int]]:
+    for i in range(start, stop):
+        yield popularity[i], ids[i]
+
+
+class RuntimeIndex(MirrorIndex):
+    """
+    In-memory index of the mirrored movies by runtime, answering runtime window queries in order of popularity.
+
+    The movies are kept in parallel arrays sorted by runtime and, within the same runtime, by descending popularity,
+    so a window is found and counted with two binary searches.
+    """
+
+    def clear(self):
+        # The runtimes, the negated popularity (so every run of a runtime is sorted ascending like the runtimes) and the
+        # ids. Writers replace the arrays as a whole, so readers use them without holding the lock.
+        self._arrays: Tuple[array, array, array] = (array('l'), array('d'), array('q'))
+        self._keys: Dict[int, Tuple[int, float]] = {}
+        # The last excluded set seen by `page` and the sorted runtimes of its indexed movies.
+        self._excluded: Optional[Tuple[AbstractSet[int], List[int]]] = None
+
+    def size(self) -> int:
+        return len(self._arrays[2])
+
+    def _read(self, since: float) -> List[Tuple]:
+        return list(self.mirror.synced_since(since))
+
+    @staticmethod
+    def _key(runtime: Optional[int], popularity: Optional[float]) -> Optional[Tuple[int, float]]:
+        return None if runtime is None else (int(runtime), -(popularity or 0.0))
+
+    def _row(self, movie: dict) -> Tuple:
+        return movie['id'], movie.get('runtime'), movie.get('popularity')
+
+    def update(self, movies: Iterable[Tuple[int, Optional[int], Optional[float]]]):
+        """
+        Add or move a batch of (id, runtime, popularity) rows, the arrays are copied once for the whole batch.
+
+        :param movies: The rows.
+        """
+        with self._lock:
+            changes = [(movie_id, self._key(runtime, popularity)) for movie_id, runtime, popularity in movies]
+            changes = [(movie_id, key) for movie_id, key in changes if self._keys.get(movie_id) != key]
+            if not changes:
+                return
+            if self._excluded is not None and any(movie_id in self._excluded[0] for movie_id, _ in changes):
+                self._excluded = None
+            runtimes, popularity, ids = (array(a.typecode, a) for a in self._arrays)
+            for movie_id, key in changes:
+                old = self._keys.pop(movie_id, None)
+                if old is not None:
+                    position = self._position(runtimes, popularity, old)
+                    while ids[position] != movie_id:
+                        position += 1
+                    del runtimes[position], popularity[position], ids[position]
+                if key is not None:
+                    position = self._position(runtimes, popularity, key)
+                    runtimes.insert(position, key[0])
+                    popularity.insert(position, key[1])
+                    ids.insert(position, movie_id)
+                    self._keys[movie_id] = key
+            self._arrays = (runtimes, popularity, ids)
+
+    @staticmethod
+    def _position(runtimes: array, popularity: array, key: Tuple[int, float]) -> int:
+        lo = bisect_left(runtimes, key[0])
+        return bisect_left(popularity, key[1], lo, bisect_right(runtimes, key[0], lo))
+
+    def load(self, movies: Iterable[Tuple[int, Optional[int], Optional[float]]]):
+        """
+        Bulk load (id, runtime, popularity) rows, the arrays are rebuilt with a single sort.
+
+        :param movies: The rows.
+        """
+        with self._lock:
+            for movie_id, runtime, popularity in movies:
+                key = self._key(runtime, popularity)
+                if key is None:
+                    self._keys.pop(movie_id, None)
+                else:
+                    self._keys[movie_id] = key
+            self._excluded = None
+            rows = sorted((key, movie_id) for movie_id, key in self._keys.items())
+            self._arrays = (array('l', (key[0] for key, _ in rows)), array('d', (key[1] for key, _ in rows)),
+                            array('q', (movie_id for _, movie_id in rows)))
+
+    def _window(self, low: int, high: int) -> Tuple[Tuple[array, array, array], int, int]:
+        self._refresh_if_due()
+        arrays = self._arrays
+        start = bisect_left(arrays[0], low)
+        return arrays, start, bisect_right(arrays[0], high, start)
+
+    def window(self, low: int, high: int) -> Iterator[int]:
+        """
+        Iterate over the movies with a runtime between `low` and `high` minutes (inclusive), most popular first.
+
+        The window holds one run per runtime value, every run is already sorted by popularity and is found with a
+        binary search. The runs are merged lazily, so only the movies up to the last one consumed are touched.
+
+        :param low: The minimum runtime.
+        :param high: The maximum runtime.
+        :return: The movie identifiers.
+        """
+        (runtimes, popularity, ids), start, end = self._window(low, high)
+        runs = []
+        while start < end:
+            stop = bisect_right(runtimes, runtimes[start], start, end)
+            runs.append(_run(popularity, ids, start, stop))
+            start = stop
+        return (movie_id for _, movie_id in heapq.merge(*runs))
+
+    def count(self, low: int, high: int) -> int:
+        """
+        Get the number of movies with a runtime between `low` and `high` minutes (inclusive).
+        """
+        _, start, end = self._window(low, high)
+        return end - start
+
+    def runtime(self, movie_id: int) -> Optional[int]:
+        """
+        Get the indexed runtime of a movie, None if the movie isn't indexed.
+        """
+        key = self._keys.get(movie_id)
+        return None if key is None else key[0]
+
+    def page(self, low: int, high: int, page: int, per_page: int, excluded=frozenset()) -> Tuple[List[int], int]:
+        """
+        Get a page of the movies with a runtime between `low` and `high` minutes, most popular first.
+
+        The excluded movies in the window are counted in the sorted runtimes of the excluded movies, which are only
+        collected again when the excluded set is replaced or one of its movies is reindexed.
+
+        :param low: The minimum runtime.
+        :param high: The maximum runtime.
+        :param page: The page number.
+        :param per_page: The number of movies per page.
+        :param excluded: Movies to leave out, e.g. the deleted movies.
+        :return: The movie identifiers of the page and the total number of movies in the window.
+        """
+        total = self.count(low, high)
+        if excluded:
+            total -= self._count_excluded(excluded, low, high)
+        movies = (movie_id for movie_id in self.window(low, high) if movie_id not in excluded)
+        return list(itertools.islice(movies, (page - 1) * per_page, page * per_page)), total
+
+    def _count_excluded(self, excluded: AbstractSet[int], low: int, high: int) -> int:
+        memo = self._excluded
+        if memo is None or memo[0] is not excluded:
+            # Under the lock, so a concurrent update can't reindex an excluded movie while its runtime is collected.
+            with self._lock:
+                keys = map(self._keys.get, excluded)
+                memo = self._excluded = (excluded, sorted(key[0] for key in keys if key is not None))
+        return bisect_right(memo[1], high) - bisect_left(memo[1], low)
+
+# Runtime index of this worker.
+runtime_index = RuntimeIndex()
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Optional, Tuple
+
+from .cache import MISS, CacheEntry, CachePolicy, ResponseCache, create_backend
+from .tmdb_async import tmdb_async
+from .tmdb_service import tmdb
+from ..util import metrics
+
+# Key suffix of the entry recording when a session was last invalidated. It lives as long as the longest cached entry of
+# a session, responses of calls started before it are never cached.
+INVALIDATED = '~invalidated'
+
+
+class SessionCache:
+    """
+    Cache for the upstream responses of a user session, e.g. the account details and the favorite movies.
+
+    Entries live for the short ttl of the first matching policy of `SESSION_CACHE_POLICIES` and are keyed by a SHA-256
+    hash of the session id, so session ids never end up in the cache. All entries of a session are dropped when it
+    changes its favorites or logs out, responses of calls that were in flight at that time aren't cached.
+    """
+
+    def __init__(self):
+        self.cache: ResponseCache = ResponseCache()
+        self.marker_ttl = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        """
+        Configure the cache from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.cache = ResponseCache(policies=app.config['SESSION_CACHE_POLICIES'],
+                                   backend=create_backend(app.config, 'SESSION', 'session_entries'))
+        self.marker_ttl = max((policy.ttl + policy.stale_ttl for policy in self.cache.policies), default=0)
+        self.invalidations = 0
+        metrics.registry.register_collector(self.collect)
+
+    @staticmethod
+    def prefix(session_id: str) -> str:
+        """
+        Get the key prefix of all entries of a session.
+        """
+        return 'session/' + hashlib.sha256(session_id.encode()).hexdigest() + '/'
+
+    async def get_json(self, path: str, session_id: str, params: Optional[dict] = None) -> Tuple[int, Any]:
+        """
+        Perform a GET request for a session and parse its body, served from the cache when the path has a policy.
+
+        Concurrent identical calls of the same session that miss the cache are coalesced into a single upstream call.
+        The cache is read and written on the default executor of the loop, a SQLite backend may block.
+
+        :param path: The path relative to the API version root.
+        :param session_id: The session id of the user.
+        :param params: Additional query params.
+        :return: The status code and the parsed body of the response.
+        """
+        policy = self.cache.policy(path)
+        prefix = self.prefix(session_id)
+        key = prefix + self.cache.key(path, params)
+        if policy is not None:
+            entry, _ = await asyncio.to_thread(self.cache.get, key)
+            if entry is not None:
+                metrics.record_lookup(path, metrics.HIT)
+                return tmdb.parse(200, entry.body)
+
+        start = time.perf_counter()
+        executed = []
+
+        def fetch():
+            executed.append(True)
+            return self._fetch(key, prefix, path, session_id, params, policy)
+
+        result = await tmdb_async.flights.do(key, fetch)
+        cache = (metrics.MISS if policy is not None else metrics.BYPASS) if executed else metrics.COALESCED
+        metrics.record_lookup(path, cache, time.perf_counter() - start)
+        return tmdb.parse(*result)
+
+    async def _fetch(self, key: str, prefix: str, path: str, session_id: str, params: Optional[dict],
+                     policy: Optional[CachePolicy]) -> Tuple[int, bytes]:
+        """
+        Fetch a response from the upstream and cache it when successful, unless the session was invalidated meanwhile.
+
+        :return: The status code and the raw body of the response.
+        """
+        started = time.time()
+        response = await tmdb_async.get(path, (params or {}) | {'session_id': session_id})
+        if policy is not None and response.status_code == 200:
+            await asyncio.to_thread(self._store, key, prefix, response.content, policy, started)
+        return response.status_code, response.content
+
+    def _store(self, key: str, prefix: str, body: bytes, policy: CachePolicy, started: float):
+        """
+        Cache a response of a call started at `started`, unless the session was invalidated since.
+        """
+        invalidated = self.cache.backend.get(prefix + INVALIDATED)
+        if invalidated is not None and invalidated.state(time.time()) == MISS:
+            self.cache.backend.delete(prefix + INVALIDATED)
+            invalidated = None
+        if invalidated is None or invalidated.stored_at < started:
+            self.cache.set(key, body, policy)
+
+    def invalidate(self, session_id: str):
+        """
+        Drop all entries of a session, e.g. after it changed its favorites or logged out.
+
+        :param session_id: The session id of the user.
+        """
+        prefix = self.prefix(session_id)
+        self.cache.delete_prefix(prefix)
+        self.cache.backend.set(prefix + INVALIDATED, CacheEntry(b'', self.marker_ttl, 0))
+        self.invalidations += 1
+
+    def collect(self):
+        """
+        Counters of the cache of this worker, see `MetricsRegistry.register_collector`.
+        """
+        stats = self.cache.stats()
+        for name in ('hits', 'misses'):
+            yield f'session_cache_{name}', {}, stats[name]
+        yield 'session_cache_invalidations', {}, self.invalidations
+
+
+# Session cache shared by all controllers of this worker.
+session_cache = SessionCache()
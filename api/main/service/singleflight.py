@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    """
+    An in-flight call and, once finished, its outcome.
+    """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller executes the call, callers arriving while it is
+    in flight wait for it and share its outcome.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        """
+        Execute `func`, unless a call with the same key is already in flight.
+
+        :param key: The key identifying the call.
+        :param func: The call.
+        :return: The result of the call, exceptions of the call are raised for every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the executed and coalesced calls.
+        """
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """
+    Coroutine counterpart of `SingleFlight`, all callers must run on the same event loop.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable]) -> Any:
+        """
+        Await `func()`, unless a call with the same key is already in flight.
+
+        :param key: The key identifying the call.
+        :param func: Function returning the awaitable call.
+        :return: The result of the call, exceptions of the call are raised for every caller.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shield the shared call from the cancellation of a single waiter.
+            return await asyncio.shield(future)
+
+        self.executed += 1
+        future = self._calls[key] = asyncio.ensure_future(func())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._calls.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters of the executed and coalesced calls.
+        """
+        return {'executed': self.executed, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
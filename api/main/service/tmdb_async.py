@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+from typing import Any, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is only needed for the non-blocking client
+    httpx = None
+
+from .cache import CacheEntry, CachePolicy, STALE
+from .singleflight import AsyncSingleFlight
+from .governor import governor
+from .tmdb_service import (IDEMPOTENT_METHODS, RETRY_STATUSES, UPSTREAM_ERRORS as SYNC_UPSTREAM_ERRORS, Timeout,
+                           tmdb)
+from ..util import metrics
+
+# Errors of upstream calls that didn't get a response, raised by httpx or by the synchronous fallback.
+UPSTREAM_ERRORS = SYNC_UPSTREAM_ERRORS + ((httpx.HTTPError,) if httpx is not None else ())
+
+
+class AsyncTMDBClient:
+    """
+    Non-blocking counterpart of `TMDBClient`, used by coroutine resources.
+
+    The settings and the response cache are shared with the synchronous `tmdb` client. Upstream calls go through a
+    pooled `httpx.AsyncClient`, when httpx isn't installed they fall back to the synchronous client on the default
+    executor of the loop.
+    """
+
+    def __init__(self):
+        self._client: 'httpx.AsyncClient' = None
+        # Coalesces concurrent identical upstream calls of the coroutines.
+        self.flights: AsyncSingleFlight = AsyncSingleFlight()
+
+    def _get_client(self) -> 'httpx.AsyncClient':
+        """
+        Get the pooled client, it is created lazily since it is bound to the running event loop.
+        """
+        if self._client is None:
+            connect, read = tmdb.timeout if isinstance(tmdb.timeout, tuple) else (tmdb.timeout, tmdb.timeout)
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=tmdb.pool_size, max_keepalive_connections=tmdb.pool_size),
+            )
+        return self._client
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None, timeout: Optional[Timeout] = None,
+                      **kwargs):
+        """
+        Perform a request against The Movie Database API, idempotent requests are retried with backoff on 429/5xx.
+
+        :param method: The HTTP method.
+        :param path: The path relative to the API version root.
+        :param params: Additional query params.
+        :param timeout: Optional timeout overriding the configured one.
+        :return: The upstream response, exposing `status_code`, `content` and `json()` like a `requests.Response`.
+        """
+        if httpx is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: tmdb.request(method, path, params, timeout=timeout, **kwargs)
+            )
+
+        client = self._get_client()
+        if isinstance(timeout, tuple):
+            kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0])
+        elif timeout is not None:
+            kwargs['timeout'] = timeout
+        attempts = tmdb.retries + 1 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            await governor.acquire_async()
+            start = time.perf_counter()
+            response = await client.request(method, tmdb.url(path), params=tmdb.params(params), **kwargs)
+            metrics.record_upstream(path, method, response.status_code, time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            # A requested delay is waited out by the governor for all calls, or by this call without a rate limit.
+            delay = await asyncio.to_thread(governor.backoff, response)
+            await asyncio.sleep(tmdb.backoff_factor * (2 ** attempt) if delay is None else delay)
+        return response
+
+    async def get(self, path: str, params: Optional[dict] = None, **kwargs):
+        return await self.request('GET', path, params, **kwargs)
+
+    async def post(self, path: str, params: Optional[dict] = None, **kwargs):
+        return await self.request('POST', path, params, **kwargs)
+
+    async def delete(self, path: str, params: Optional[dict] = None, **kwargs):
+        return await self.request('DELETE', path, params, **kwargs)
+
+    async def get_json(self, path: str, params: Optional[dict] = None, cached: bool = True) -> Tuple[int, Any]:
+        """
+        Non-blocking counterpart of `TMDBClient.get_json`, sharing its response cache. The cache is read and written on
+        the default executor of the loop, a SQLite backend may block.
+
+        :param path: The path relative to the API version root.
+        :param params: Additional query params.
+        :param cached: False to bypass the response cache.
+        :return: The status code and the parsed body of the response.
+        """
+        policy = tmdb.cache.policy(path) if cached else None
+        key = tmdb.cache.key(path, params)
+        if policy is not None:
+            entry, state = await asyncio.to_thread(tmdb.cache.get, key)
+            if entry is not None:
+                if state == STALE:
+                    tmdb.schedule_refresh(key, path, params, policy, entry)
+                metrics.record_lookup(path, metrics.STALE if state == STALE else metrics.HIT)
+                return 200, json.loads(entry.body)
+
+        start = time.perf_counter()
+        executed = []
+
+        def fetch():
+            executed.append(True)
+            return self._fetch(key, path, params, policy)
+
+        result = await self.flights.do(key, fetch)
+        cache = (metrics.MISS if policy is not None else metrics.BYPASS) if executed else metrics.COALESCED
+        metrics.record_lookup(path, cache, time.perf_counter() - start)
+        return tmdb.parse(*result)
+
+    async def _fetch(self, key: str, path: str, params: Optional[dict], policy: Optional[CachePolicy],
+                     entry: Optional[CacheEntry] = None) -> Tuple[int, bytes]:
+        """
+        Fetch a response from the upstream and cache it when successful and cacheable. When a cached `entry` is given
+        it is revalidated with a conditional request, an unchanged entry is kept and its body returned.
+
+        :return: The status code and the raw body of the response.
+        """
+        response = await self.get(path, params, headers=entry.validators() if entry is not None else None)
+        if response.status_code == 304 and entry is not None:
+            await asyncio.to_thread(tmdb.cache.revalidated, key, entry, policy)
+            return 200, entry.body
+        if policy is not None and response.status_code == 200:
+            await asyncio.to_thread(tmdb.cache.set, key, response.content, policy, etag=response.headers.get('ETag'),
+                                    last_modified=response.headers.get('Last-Modified'))
+        return response.status_code, response.content
+
+
+# Non-blocking client shared by all coroutine resources of this worker.
+tmdb_async = AsyncTMDBClient()
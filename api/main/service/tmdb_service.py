@@ -0,0 +1,299 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Tuple, TypeVar, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import ResponseCache, CacheEntry, CachePolicy, STALE, create_backend
+from .governor import BACKGROUND, FANOUT, governor, in_lane
+from .singleflight import SingleFlight
+from ..util import metrics
+
+# Number of results of every page of the paginated upstream endpoints.
+TMDB_PAGE_SIZE = 20
+# Last page the paginated upstream endpoints will return.
+TMDB_MAX_PAGE = 500
+# Upstream status codes that are worth retrying with backoff.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Methods that are safe to retry.
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+# Errors of upstream calls that didn't get a response, e.g. connection errors, timeouts and calls given up by the
+# governor.
+UPSTREAM_ERRORS = (requests.RequestException,)
+
+Timeout = Union[float, Tuple[float, float]]
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class TMDBClient:
+    """
+    Shared client for The Movie Database API.
+
+    Keeps a single keep-alive connection pool per worker process, retries idempotent calls with backoff on
+    429/5xx responses and injects the `api_key` and `language` query params on every call. Every attempt goes through
+    the rate limit `governor`, fan-out calls and background refreshes in their own lanes.
+    """
+
+    def __init__(self):
+        self.base_url: str = 'https://api.themoviedb.org/3'
+        self.api_key: Optional[str] = None
+        self.language: str = 'en-US'
+        self.timeout: Timeout = (3.05, 10)
+        self.pool_size: int = 10
+        self.retries: int = 3
+        self.backoff_factor: float = 0.3
+        self.session: requests.Session = self._create_session(self.pool_size, self.retries, self.backoff_factor)
+        self.cache: ResponseCache = ResponseCache()
+        # Coalesces concurrent identical upstream calls.
+        self.flights: SingleFlight = SingleFlight()
+        # Keys of stale entries that are being revalidated in the background.
+        self._refreshing: set = set()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tmdb-refresh')
+        # Bounded pool running the concurrent upstream calls of fan-out endpoints.
+        self.executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix='tmdb-fanout')
+
+    def collect(self):
+        """
+        Gauges of the response cache and the coalesced calls of this worker, see `MetricsRegistry.register_collector`.
+        """
+        for name, value in self.cache.stats().items():
+            yield f'tmdb_cache_{name}', {}, value
+        for name, value in self.flights.stats().items():
+            yield f'tmdb_flights_{name}', {}, value
+
+    def init_app(self, app):
+        """
+        Configure the client from the settings of the given Flask application.
+
+        :param app: The Flask application instance.
+        """
+        self.base_url = app.config['TMDB_BASE_URL'].rstrip('/')
+        self.api_key = app.config['THEMOVIEDB_API_KEY']
+        self.language = app.config['TMDB_LANGUAGE']
+        self.timeout = app.config['TMDB_TIMEOUT']
+        self.pool_size = app.config['TMDB_POOL_SIZE']
+        self.retries = app.config['TMDB_RETRIES']
+        self.backoff_factor = app.config['TMDB_BACKOFF_FACTOR']
+        self.session.close()
+        self.session = self._create_session(self.pool_size, self.retries, self.backoff_factor)
+        self.cache = ResponseCache(policies=app.config['TMDB_CACHE_POLICIES'], backend=create_backend(app.config))
+        metrics.registry.register_collector(self.collect)
+        governor.init_app(app)
+        metrics.registry.register_collector(governor.collect)
+        self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(max_workers=app.config['TMDB_FANOUT_WORKERS'],
+                                           thread_name_prefix='tmdb-fanout')
+
+    @staticmethod
+    def _create_session(pool_size: int, retries: int, backoff_factor: float) -> requests.Session:
+        """
+        Create a session with a pooled adapter for HTTPS and HTTP upstreams.
+
+        :param pool_size: Maximum number of kept-alive connections in the pool.
+        :param retries: Number of retries of connection errors.
+        :param backoff_factor: Backoff factor between retries, see `urllib3.util.retry.Retry`.
+        :return: The configured session.
+        """
+        # Responses with a retry status are retried by `request`, so every attempt goes through the governor.
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(),
+            respect_retry_after_header=False,
+            # Hand the last response back to the caller instead of raising.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def url(self, path: str) -> str:
+        """
+        Build the full upstream url for the given API path, e.g. `movie/550`.
+
+        :param path: The path relative to the API version root.
+        :return: The full url.
+        """
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def params(self, params: Optional[dict] = None) -> dict:
+        """
+        Merge the default query params with the given ones.
+
+        :param params: Call specific query params, these take precedence over the defaults.
+        :return: The merged query params.
+        """
+        merged = {'api_key': self.api_key or os.environ.get('THEMOVIEDB_API_KEY'), 'language': self.language}
+        if params:
+            merged.update(params)
+        return merged
+
+    def request(self, method: str, path: str, params: Optional[dict] = None, timeout: Optional[Timeout] = None,
+                **kwargs) -> requests.Response:
+        """
+        Perform a request against The Movie Database API, idempotent requests are retried with backoff on 429/5xx.
+
+        :param method: The HTTP method.
+        :param path: The path relative to the API version root.
+        :param params: Additional query params.
+        :param timeout: Optional timeout overriding the configured one.
+        :raises Throttled: If the rate limit doesn't allow the call in time.
+        :return: The upstream response.
+        """
+        attempts = self.retries + 1 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            governor.acquire()
+            start = time.perf_counter()
+            response = self.session.request(
+                method, self.url(path), params=self.params(params), timeout=timeout or self.timeout, **kwargs
+            )
+            metrics.record_upstream(path, method, response.status_code, time.perf_counter() - start)
+            if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                return response
+            # A requested delay is waited out by the governor for all calls, or by this call without a rate limit.
+            delay = governor.backoff(response)
+            time.sleep(self.backoff_factor * (2 ** attempt) if delay is None else delay)
+        return response
+
+    def get(self, path: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        return self.request('GET', path, params, **kwargs)
+
+    def post(self, path: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        return self.request('POST', path, params, **kwargs)
+
+    def delete(self, path: str, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, params, **kwargs)
+
+    def map(self, func: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """
+        Apply `func` to all items concurrently on the bounded fan-out pool.
+
+        `func` must not fan out on the pool itself, nested calls could exhaust the pool and deadlock.
+
+        :param func: The function performing the upstream call(s) for one item.
+        :param items: The items.
+        :return: The results in the order of the given items.
+        """
+        return [future.result() for future in [self.submit(func, item) for item in items]]
+
+    def submit(self, func: Callable[..., R], *args) -> 'Future[R]':
+        """
+        Run `func` on the bounded fan-out pool, in a copy of the current context so upstream calls are traced for the
+        current request. The upstream calls are made in the fan-out lane of the governor.
+
+        :param func: The function performing the upstream call(s).
+        :return: The future of the result.
+        """
+        return self.executor.submit(contextvars.copy_context().run, in_lane, FANOUT, func, *args)
+
+    def get_json(self, path: str, params: Optional[dict] = None, cached: bool = True) -> Tuple[int, Any]:
+        """
+        Perform a GET request and parse its body, served from the response cache when the path has a cache policy.
+
+        Stale entries are returned immediately while a background refresh revalidates them against the upstream.
+        Concurrent identical calls that miss the cache are coalesced into a single upstream call.
+
+        :param path: The path relative to the API version root.
+        :param params: Additional query params.
+        :param cached: False to bypass the response cache, e.g. for callers keeping their own copy such as the mirror.
+        :return: The status code and the parsed body of the response.
+        """
+        policy = self.cache.policy(path) if cached else None
+        key = self.cache.key(path, params)
+        if policy is not None:
+            entry, state = self.cache.get(key)
+            if entry is not None:
+                if state == STALE:
+                    self.schedule_refresh(key, path, params, policy, entry)
+                metrics.record_lookup(path, metrics.STALE if state == STALE else metrics.HIT)
+                return 200, json.loads(entry.body)
+
+        start = time.perf_counter()
+        executed = []
+
+        def fetch():
+            executed.append(True)
+            return self._fetch(key, path, params, policy)
+
+        result = self.flights.do(key, fetch)
+        cache = (metrics.MISS if policy is not None else metrics.BYPASS) if executed else metrics.COALESCED
+        metrics.record_lookup(path, cache, time.perf_counter() - start)
+        return self.parse(*result)
+
+    def _fetch(self, key: str, path: str, params: Optional[dict], policy: Optional[CachePolicy],
+               entry: Optional[CacheEntry] = None) -> Tuple[int, bytes]:
+        """
+        Fetch a response from the upstream and cache it when successful and cacheable. When a cached `entry` is given
+        it is revalidated with a conditional request, an unchanged entry is kept and its body returned.
+
+        :return: The status code and the raw body of the response.
+        """
+        response = self.get(path, params, headers=entry.validators() if entry is not None else None)
+        if response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key, entry, policy)
+            return 200, entry.body
+        if policy is not None and response.status_code == 200:
+            self.cache.set(key, response.content, policy, etag=response.headers.get('ETag'),
+                           last_modified=response.headers.get('Last-Modified'))
+        return response.status_code, response.content
+
+    def schedule_refresh(self, key: str, path: str, params: Optional[dict], policy: CachePolicy,
+                         entry: Optional[CacheEntry] = None):
+        """
+        Revalidate a stale entry in the background, at most once at a time per key.
+        """
+        def refresh():
+            self.flights.do(key, lambda: self._fetch(key, path, params, policy, entry))
+
+        self.refresh_in_background(key, refresh)
+
+    def refresh_in_background(self, key: str, refresh: Callable[[], Any]):
+        """
+        Run a refresh on the refresh pool, in the background lane of the governor, unless the refresh of the same key
+        is still running.
+
+        :param key: The key of what is refreshed.
+        :param refresh: The function performing the refresh.
+        """
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                refresh()
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        # Refreshes don't belong to the request that triggered them.
+        self._refresh_executor.submit(contextvars.Context().run, in_lane, BACKGROUND, run)
+
+    @staticmethod
+    def parse(status: int, body: bytes) -> Tuple[int, Any]:
+        """
+        Parse a raw response body, every caller gets its own copy so callers are free to modify it.
+
+        :param status: The status code of the response.
+        :param body: The raw body of the response.
+        :return: The status code and the parsed body, None if the body isn't JSON.
+        """
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, None
+
+
+# Client shared by all controllers of this worker.
+tmdb = TMDBClient()
@@ -0,0 +1,128 @@
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from . import mirror_service, movie_service
+from .genre_service import genres
+from .governor import BACKGROUND, lane
+from .tmdb_service import TMDB_PAGE_SIZE
+from ..util import metrics
+
+
+class Warmup:
+    """
+    Job warming the caches after a deploy, so the first requests don't pay for the full upstream chains.
+
+    It fetches the genre list, the popular pages holding the `movies` most popular movies and their details, loads the
+    indexes of the mirror and precomputes the first page of the similar movies of every one of them. Upstream calls
+    are made in the background lane of the governor by at most `concurrency` threads at a time.
+
+    The job runs in a thread when the application starts or with `python manage.py <prod|dev> warmup [movies]`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.movies = 100
+        self.concurrency = 4
+        self.min_movies = 1000
+        self.progress: dict = {}
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+        # Held by the running job, a job started while another one runs waits for it and then finds the caches warm.
+        self._running = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the job from the settings of the given Flask application and start it when enabled.
+
+        :param app: The Flask application instance.
+        """
+        self.enabled = app.config['WARMUP']
+        self.movies = app.config['WARMUP_MOVIES']
+        self.concurrency = app.config['WARMUP_CONCURRENCY']
+        self.min_movies = app.config['MIRROR_INDEX_MIN_MOVIES']
+        metrics.registry.register_collector(self.collect)
+        if self.enabled:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+                self._thread.start()
+
+    def run(self, report: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Warm the caches.
+
+        :param report: Called with the progress after every finished task.
+        :return: The progress once finished: the step, the number of finished and failed tasks, the total number of
+            tasks and the duration in seconds.
+        """
+        with self._running:
+            return self._run(report)
+
+    def _run(self, report: Optional[Callable[[dict], None]]) -> dict:
+        started = time.time()
+        self.progress = {'step': 'genres', 'done': 0, 'failed': 0, 'total': 0, 'duration': 0.0}
+        with lane(BACKGROUND), ThreadPoolExecutor(self.concurrency, thread_name_prefix='warmup') as executor:
+
+            def step(name: str, func: Callable, items: Iterable) -> List:
+                """
+                Apply `func` to all items concurrently, failed items are counted and left out of the results.
+                """
+                items = list(items)
+                self.progress['step'] = name
+                self.progress['total'] += len(items)
+                futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+                results = []
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                        self.progress['done'] += 1
+                    except Exception:
+                        self.progress['failed'] += 1
+                    self.progress['duration'] = time.time() - started
+                    if report is not None:
+                        report(dict(self.progress))
+                return results
+
+            step('genres', lambda _: genres.load(), [None])
+
+            pages = step('popular', lambda p: (p, movie_service.get_popular_page(p)),
+                         range(1, math.ceil(self.movies / TMDB_PAGE_SIZE) + 1))
+            movie_ids = [movie['id'] for _, page in sorted(pages, key=lambda page: page[0]) if page is not None
+                         for movie in page['results']][:self.movies]
+
+            movies = [movie for status, movie in step('details', mirror_service.get_movie, movie_ids) if status == 200]
+
+            step('indexes', lambda index: index.refresh(), mirror_service.indexes)
+
+            step('similar', lambda task: task[0](task[1], 1, TMDB_PAGE_SIZE, self.min_movies),
+                 self._similar(movies))
+        return self.progress
+
+    @staticmethod
+    def _similar(movies: List[dict]) -> Iterable[Tuple[Callable, object]]:
+        """
+        The first pages of the similar movies of every movie, as requested by `/movie/similar-*`.
+        """
+        for movie in movies:
+            yield movie_service.similar_genre_movies, [genre['id'] for genre in movie['genres']]
+            yield movie_service.similar_runtime_movies, movie['runtime']
+            yield movie_service.overlapping_actors_movies, [actor['id'] for actor in movie['credits']['cast']]
+
+    def collect(self):
+        """
+        Gauges of the progress of the job, see `MetricsRegistry.register_collector`.
+        """
+        for name, value in self.progress.items():
+            if name != 'step':
+                yield f'warmup_{name}', {}, value
+
+
+# Warm-up job of this worker.
+warmup = Warmup()
@@ -0,0 +1,79 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from functools import wraps
+from typing import Any, Awaitable
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a daemon thread of this worker.
+
+    All coroutines of the API run on this loop, so their upstream calls share a single non-blocking connection pool
+    and concurrent awaits interleave instead of each occupying a thread.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The event loop, started on first use.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='event-loop', daemon=True).start()
+            return self._loop
+
+    def run(self, coro: Awaitable) -> Any:
+        """
+        Run a coroutine on the loop and wait for its result.
+
+        The coroutine runs in a copy of the current context, so the Flask request and application contexts remain
+        available while it runs. Must not be called from the loop itself.
+
+        :param coro: The coroutine.
+        :return: The result of the coroutine.
+        """
+        loop = self.loop
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+
+        def done(task: asyncio.Task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        def start():
+            # Tasks copy the context that is current when they are created.
+            context.run(loop.create_task, coro).add_done_callback(done)
+
+        loop.call_soon_threadsafe(start)
+        return future.result()
+
+
+# Event loop shared by all resources of this worker.
+event_loop = EventLoopThread()
+
+
+def asynchronous(func):
+    """
+    A decorator that allows a resource method to be a coroutine function. The coroutine runs on the shared event loop
+    of the worker while the calling thread waits for its result, so it can be used below `marshal_with` and friends.
+
+    :param func: The coroutine function to decorate.
+    :return: The decorated function.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return event_loop.run(func(*args, **kwargs))
+
+    return wrapper
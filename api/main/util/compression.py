@@ -0,0 +1,173 @@
+import gzip
+import os
+import zlib
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, Optional
+
+from flask import Flask, Response, request
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, responses fall back to gzip
+    brotli = None
+
+from ..service.cache import CacheEntry, MemoryBackend
+
+# Content types worth compressing, other types such as images are compressed already.
+COMPRESSIBLE = frozenset({
+    'application/json', 'application/x-ndjson', 'application/javascript', 'text/javascript', 'text/css', 'text/html',
+    'text/plain', 'image/svg+xml',
+})
+
+
+class Encoder(ABC):
+    """
+    A content coding, compressing whole bodies and streamed bodies.
+    """
+    name: str = None
+    # File extension of precompressed static assets.
+    extension: str = None
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Compress a streamed body, every chunk is flushed so it reaches the client as soon as it is produced.
+        """
+
+
+class GzipEncoder(Encoder):
+    name = 'gzip'
+    extension = '.gz'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        # A fixed mtime keeps the output of identical bodies identical.
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class BrotliEncoder(Encoder):
+    name = 'br'
+    extension = '.br'
+
+    def __init__(self, quality: int = 5):
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        compressor = brotli.Compressor(quality=self.quality)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+class Compressor:
+    """
+    Compresses the responses of the application with the best coding accepted by the client.
+
+    Compressed bodies are cached by the ETag of the response and the coding, hot responses and static assets are
+    compressed once instead of on every request. Static assets that are shipped precompressed, e.g. `app.js.br` next
+    to `app.js`, are served as is.
+    """
+
+    def __init__(self):
+        self.encoders = {}
+        self.min_size = 0
+        self.static_folder: Optional[str] = None
+        self.variants = MemoryBackend()
+
+    def init_app(self, app: Flask):
+        """
+        Configure compression from the settings of the given Flask application and compress its responses.
+
+        :param app: The Flask application instance.
+        """
+        self.encoders = {'gzip': GzipEncoder(app.config['COMPRESS_GZIP_LEVEL'])}
+        if brotli is not None:
+            self.encoders['br'] = BrotliEncoder(app.config['COMPRESS_BROTLI_QUALITY'])
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.static_folder = app.static_folder
+        self.variants = MemoryBackend(max_entries=app.config['COMPRESS_CACHE_MAX_ENTRIES'],
+                                      max_bytes=app.config['COMPRESS_CACHE_MAX_BYTES'])
+        app.after_request(self.compress)
+
+    def negotiate(self) -> Optional[Encoder]:
+        """
+        Get the encoder of the coding the client prefers, brotli wins ties.
+
+        :return: The encoder, None if the client accepts none of the codings.
+        """
+        name = request.accept_encodings.best_match(['br', 'gzip'] if 'br' in self.encoders else ['gzip'])
+        return self.encoders.get(name)
+
+    def compress(self, response: Response) -> Response:
+        """
+        Compress a response, called after every request.
+        """
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoder = self.negotiate()
+        if encoder is None:
+            return response
+
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = encoder.stream(response.iter_encoded())
+            response.headers.pop('Content-Length', None)
+        else:
+            # Static files are sent as a file wrapper, read them so they can be compressed.
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self._compressed(response, encoder, data))
+
+        response.headers['Content-Encoding'] = encoder.name
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The bytes differ from the uncompressed representation, the ETag is only equivalent.
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compressed(self, response: Response, encoder: Encoder, data: bytes) -> bytes:
+        etag, _ = response.get_etag()
+        if etag is None:
+            return encoder.compress(data)
+        key = f'{encoder.name}:{etag}'
+        entry = self.variants.get(key)
+        if entry is not None:
+            return entry.body
+        body = self._precompressed(encoder) or encoder.compress(data)
+        self.variants.set(key, CacheEntry(body, ttl=float('inf'), stale_ttl=0))
+        return body
+
+    def _precompressed(self, encoder: Encoder) -> Optional[bytes]:
+        """
+        Get the precompressed variant of the requested static asset, if one is shipped.
+        """
+        if request.endpoint != 'static' or self.static_folder is None:
+            return None
+        path = safe_join(self.static_folder, request.view_args['filename'] + encoder.extension)
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+# Response compression of the application.
+compressor = Compressor()
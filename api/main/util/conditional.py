@@ -0,0 +1,34 @@
+from flask import Flask, Response, request
+
+
+def init_app(app: Flask):
+    """
+    Make the JSON responses of the API conditional. Every successful GET response gets a strong `ETag` computed from
+    its body and a `Cache-Control` header, requests whose `If-None-Match` matches get an empty 304 response instead.
+
+    Routes listed in `CACHE_CONTROL_MAX_AGE` may be reused by clients for that many seconds, all other routes must be
+    revalidated first. Responses of requests carrying a `session_id` are private to that user and must always be
+    revalidated. Streamed responses are sent as is, their body isn't known upfront.
+
+    :param app: The Flask application instance.
+    """
+    max_ages = app.config['CACHE_CONTROL_MAX_AGE']
+
+    @app.after_request
+    def make_conditional(response: Response) -> Response:
+        if (request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.is_streamed
+                or response.mimetype != 'application/json' or request.url_rule is None):
+            return response
+
+        max_age = max_ages.get(request.url_rule.rule)
+        if 'session_id' in request.args:
+            # Responses of a user session must not be stored by shared caches, whatever their route.
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        elif max_age is None:
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        response.add_etag()
+        return response.make_conditional(request)
@@ -1,19 +1,23 @@
+from ..model.deleted_movie import DeletedMovies
+from ..service.tmdb_service import TMDB_MAX_PAGE, TMDB_PAGE_SIZE, tmdb
 from ..util.dto import MovieDto
 
-from typing import Dict, List
+import asyncio
+import itertools
+import math
+from typing import Awaitable, Callable, Generator, List, Optional
 
-#  A dictionary containing deleted movies. The keys are the movie IDs and the values are
-#  dictionaries containing movie details.
-deletedMovies: Dict[int, dict] = {}
+#  The durable store of deleted movies, supports `movie_id in deletedMovies` lookups.
+deletedMovies: DeletedMovies = DeletedMovies()
 
 
-def add_deleted_movie(data: dict):
+def add_deleted_movie(movie_id: int):
     """
-    Add a deleted movie to the `deletedMovies` dictionary.
+    Add a deleted movie to the `deletedMovies` store.
 
-    :param data: A dictionary containing movie details, including the ID of the movie.
+    :param movie_id: The ID of the movie.
     """
-    deletedMovies.update({data['id']: data})
+    deletedMovies.add(movie_id)
 
 
 def get_deleted_movies_ids() -> List:
@@ -22,7 +26,42 @@ def get_deleted_movies_ids() -> List:
 
     :return: A list of IDs for all deleted movies.
     """
-    return list(deletedMovies.keys())
+    return deletedMovies.ids()
+
+
+def remove_deleted_movies(movies: List[dict]) -> int:
+    """
+    Remove the deleted movies from a list of movies, in place and in a single pass.
+
+    :param movies: The movies.
+    :return: The number of removed movies.
+    """
+    if not len(deletedMovies):
+        return 0
+    deleted = deletedMovies.snapshot()
+    kept = 0
+    for movie in movies:
+        if movie['id'] not in deleted:
+            movies[kept] = movie
+            kept += 1
+    removed = len(movies) - kept
+    del movies[kept:]
+    return removed
+
+
+def filter_deleted_page(page: dict) -> dict:
+    """
+    Remove the deleted movies from a paginated response in place and correct its totals.
+
+    :param page: The paginated response.
+    :return: The same paginated response.
+    """
+    removed = remove_deleted_movies(page['results'])
+    if removed:
+        per_page = len(page['results']) + removed
+        page['total_results'] = max(0, page['total_results'] - removed)
+        page['total_pages'] = math.ceil(page['total_results'] / per_page)
+    return page
 
 
 def filter_deleted_movies(func):
@@ -35,17 +74,10 @@ def filter_deleted_movies(func):
 
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
-        # If return type is a list, filter out the deleted movies.
-        if isinstance(result, list):
-            result = [movie for movie in result if movie['id'] not in deletedMovies]
-        # If return type is a dict and is a deleted movie, abort and return 404
-        elif isinstance(result, dict) and 'id' in result:
-            if result['id'] in deletedMovies:
-                return MovieDto.api.abort(404, f"Movie {result['id']} not found.")
-        elif isinstance(result, dict) and 'data' in result:
-            result['data']['results'] = [movie for movie in result['data']['results'] if
-                                         movie['id'] not in deletedMovies]
-        return result
+        if isinstance(result, dict) and 'data' in result and 'id' not in result:
+            filter_deleted_page(result['data'])
+            return result
+        return filter_deleted_movies_func(result)
 
     return wrapper
 
@@ -60,12 +92,118 @@ def filter_deleted_movies_func(result: object) -> object:
     """
     # If return type is a list, filter out the deleted movies.
     if isinstance(result, list):
-        result = [movie for movie in result if movie['id'] not in deletedMovies]
+        remove_deleted_movies(result)
     # If return type is a dict and is a deleted movie, abort and return 404
     elif isinstance(result, dict) and 'id' in result:
         if result['id'] in deletedMovies:
             return MovieDto.api.abort(404, f"Movie {result['id']} not found.")
     elif isinstance(result, dict) and 'page' in result:
-        result['results'] = [movie for movie in result['results'] if
-                                     movie['id'] not in deletedMovies]
+        filter_deleted_page(result)
     return result
+
+
+def paginate(page: int, per_page: int) -> Generator[List[int], List[Optional[dict]], Optional[dict]]:
+    """
+    Build a page of `per_page` movies from a paginated upstream endpoint, without the deleted movies.
+
+    Upstream pages hold `TMDB_PAGE_SIZE` movies. Only the upstream pages covering the page are fetched, concurrently.
+    When deleted movies make the page fall short, it is backfilled from just enough of the next upstream pages, up to
+    the last page of upstream, and the totals are corrected for the removed movies seen. Pages start at their offset
+    among all movies, so a backfilled movie can show up again at the start of the next page.
+
+    This is a generator so it can be driven both by blocking and by coroutine code, see `paginate_filtered` and
+    `paginate_filtered_async`: it yields the numbers of the upstream pages it needs next and must be sent their bodies,
+    None for pages that can't be retrieved.
+
+    :param page: The page number, with pages of `per_page` movies. Pages before the first are the first page.
+    :param per_page: The number of movies per page.
+    :return: The paginated response, or None if the first upstream page of the page couldn't be retrieved.
+    """
+    page, per_page = max(1, page), max(1, per_page)
+    offset = (page - 1) * per_page
+    start = offset // TMDB_PAGE_SIZE + 1
+    if start > TMDB_MAX_PAGE:
+        # Upstream serves no movies this far, only its totals are needed.
+        first = (yield [1])[0]
+        if first is None:
+            return None
+        return {
+            'page': page,
+            'results': [],
+            'total_results': first['total_results'],
+            'total_pages': math.ceil(first['total_results'] / per_page),
+        }
+
+    deleted = deletedMovies.snapshot()
+    numbers = list(range(start, min((offset + per_page - 1) // TMDB_PAGE_SIZE + 1, TMDB_MAX_PAGE) + 1))
+    bodies = yield numbers
+    first = bodies[0]
+    if first is None:
+        return None
+    # Pages line up with the upstream pages and nothing has been deleted, the upstream page is the answer.
+    if per_page == TMDB_PAGE_SIZE and not deleted:
+        return first
+
+    last_page = min(first['total_pages'], TMDB_MAX_PAGE)
+    results: List[dict] = []
+    removed = 0
+    while True:
+        missing = False
+        for number, body in zip(numbers, bodies):
+            if body is None:
+                missing = True
+                break
+            for movie in itertools.islice(body['results'], offset % TMDB_PAGE_SIZE if number == start else 0, None):
+                if len(results) == per_page:
+                    break
+                if movie['id'] in deleted:
+                    removed += 1
+                else:
+                    results.append(movie)
+        short = per_page - len(results)
+        if missing or not short or numbers[-1] >= last_page:
+            break
+        numbers = list(range(numbers[-1] + 1, min(numbers[-1] + math.ceil(short / TMDB_PAGE_SIZE), last_page) + 1))
+        bodies = yield numbers
+
+    total_results = max(0, first['total_results'] - removed)
+    return {
+        'page': page,
+        'results': results,
+        'total_results': total_results,
+        'total_pages': math.ceil(total_results / per_page),
+    }
+
+
+def paginate_filtered(fetch_page: Callable[[int], Optional[dict]], page: int, per_page: int) -> Optional[dict]:
+    """
+    Build a page of movies without the deleted movies, see `paginate`.
+
+    :param fetch_page: Function retrieving the body of an upstream page, or None if it can't be retrieved. It must not
+        fan out on the pool of `tmdb` itself, see `TMDBClient.map`.
+    :param page: The page number, with pages of `per_page` movies.
+    :param per_page: The number of movies per page.
+    :return: The paginated response, or None if the upstream pages couldn't be retrieved.
+    """
+    steps = paginate(page, per_page)
+    try:
+        numbers = next(steps)
+        while True:
+            bodies = [fetch_page(numbers[0])] if len(numbers) == 1 else tmdb.map(fetch_page, numbers)
+            numbers = steps.send(bodies)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def paginate_filtered_async(fetch_page: Callable[[int], Awaitable[Optional[dict]]], page: int,
+                                  per_page: int) -> Optional[dict]:
+    """
+    Coroutine counterpart of `paginate_filtered`.
+    """
+    steps = paginate(page, per_page)
+    try:
+        numbers = next(steps)
+        while True:
+            numbers = steps.send(await asyncio.gather(*map(fetch_page, numbers)))
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,109 @@
+import json
+import time
+from functools import wraps
+from http import HTTPStatus
+from typing import Iterable
+
+from flask import Response, current_app, request, stream_with_context
+from flask_restx import Namespace
+from flask_restx.marshalling import marshal_with as restx_marshal_with
+from flask_restx.utils import merge
+
+from .metrics import record_marshal
+from .serializer import serialize
+
+
+def marshal_with(ns: Namespace, fields, as_list: bool = False, code: int = HTTPStatus.OK, description: str = None,
+                 **kwargs):
+    """
+    Drop-in replacement for `Namespace.marshal_with` that leaves responses which are already built, such as streamed
+    responses, untouched and records the marshalling time in the trace of the request. The Swagger documentation is
+    identical to the one of `Namespace.marshal_with`.
+
+    Return values are serialized with the compiled serializer of the model, the output is identical to the one of
+    flask-restx, which is only used for responses with a field mask or a status code and headers.
+
+    :param ns: The namespace of the resource.
+    :param fields: The model used to marshal the return values.
+    :param as_list: Indicate that the return type is a list (for the documentation).
+    :param code: The documented HTTP response code.
+    :param description: The documented response description.
+    :return: The decorator.
+    """
+
+    def wrapper(func):
+        doc = {
+            'responses': {
+                str(code): (description, [fields], kwargs) if as_list else (description, fields, kwargs)
+            },
+            '__mask__': kwargs.get('mask', True),
+        }
+        func.__apidoc__ = merge(getattr(func, '__apidoc__', {}), doc)
+        marshaller = restx_marshal_with(fields, ordered=ns.ordered, **kwargs)
+        envelope = kwargs.get('envelope')
+        compiled = not ns.ordered and set(kwargs) <= {'envelope'}
+
+        @wraps(func)
+        def marshalled(*args, **kw):
+            resp = func(*args, **kw)
+            if isinstance(resp, Response):
+                return resp
+            start = time.perf_counter()
+            if compiled and not isinstance(resp, tuple) and not request.headers.get(
+                    current_app.config.get('RESTX_MASK_HEADER', 'X-Fields')):
+                marshalled_resp = serialize(resp, fields, envelope)
+            else:
+                marshalled_resp = marshaller(lambda: resp)()
+            record_marshal(time.perf_counter() - start)
+            return marshalled_resp
+
+        return marshalled
+
+    return wrapper
+
+
+def marshal_list_with(ns: Namespace, fields, **kwargs):
+    """
+    Drop-in replacement for `Namespace.marshal_list_with`, see `marshal_with`.
+    """
+    return marshal_with(ns, fields, as_list=True, **kwargs)
+
+
+def stream_paginated(page: dict, results: Iterable[dict], fields, envelope: str = 'data') -> Response:
+    """
+    Stream a paginated response, every result is marshalled and written as soon as it is available.
+
+    The body has the same structure as marshalling the page with the `paginated` model.
+
+    :param page: The page, its `page`, `total_results` and `total_pages` values are written around the results.
+    :param results: The (lazily retrieved) results of the page.
+    :param fields: The model used to marshal every result.
+    :param envelope: The key enveloping the page.
+    :return: The streamed response.
+    """
+
+    def generate():
+        yield f'{{{json.dumps(envelope)}: {{"page": {json.dumps(page.get("page"))}, "results": ['
+        separator = ''
+        for result in results:
+            yield separator + json.dumps(serialize(result, fields))
+            separator = ', '
+        yield (f'], "total_results": {json.dumps(page.get("total_results"))}, '
+               f'"total_pages": {json.dumps(page.get("total_pages"))}}}}}\n')
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def stream_ndjson(records: Iterable[dict]) -> Response:
+    """
+    Stream records as newline delimited JSON, every record is written as soon as it is available.
+
+    :param records: The (lazily retrieved) records, already marshalled.
+    :return: The streamed response.
+    """
+
+    def generate():
+        for record in records:
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,255 @@
+import contextvars
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, Response, g, request
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the upstream calls per request histogram buckets.
+CALL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense.
+    """
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Process wide registry of counters and histograms, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, dict, float]]]] = []
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self._help[name] = help
+        self._buckets[name] = tuple(buckets)
+        self._histograms.setdefault(name, {})
+
+    def counter(self, name: str, help: str):
+        self._help[name] = help
+        self._counters.setdefault(name, {})
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram(self._buckets[name])
+            series[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, dict, float]]]):
+        """
+        Register a function returning (name, labels, value) gauges that are read at every scrape. Registering the same
+        function again has no effect.
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels: Iterable[Tuple[str, str]]) -> str:
+        labels = list(labels)
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f'# HELP {name} {self._help[name]}', f'# TYPE {name} counter']
+                lines += [f'{name}{self._labels(labels)} {value}' for labels, value in series.items()]
+            for name, series in self._histograms.items():
+                lines += [f'# HELP {name} {self._help[name]}', f'# TYPE {name} histogram']
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{self._labels(labels + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{self._labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{self._labels(labels)} {histogram.count}')
+        gauges: Dict[str, List[str]] = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        for name, samples in gauges.items():
+            lines += [f'# TYPE {name} gauge'] + samples
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTrace:
+    """
+    The upstream calls and marshalling time of a single API request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.upstream: List[Tuple[str, float, str]] = []
+        self.marshal = 0.0
+
+    def add_upstream(self, path: str, duration: float, cache: str):
+        with self._lock:
+            self.upstream.append((path, duration, cache))
+
+    def add_marshal(self, duration: float):
+        with self._lock:
+            self.marshal += duration
+
+    @property
+    def calls(self) -> int:
+        """
+        Number of calls that actually went upstream.
+        """
+        return sum(1 for _, _, cache in self.upstream if cache == UPSTREAM)
+
+    @property
+    def cached(self) -> int:
+        """
+        Number of lookups that were answered without an upstream call.
+        """
+        return len(self.upstream) - self.calls
+
+
+# How upstream lookups were answered: from the cache, stale from the cache, by a call of another request, by an
+# upstream call after a cache miss or by an upstream call of an uncacheable path.
+HIT = 'hit'
+STALE = 'stale'
+COALESCED = 'coalesced'
+MISS = 'miss'
+BYPASS = 'bypass'
+# Trace entries of calls that went upstream.
+UPSTREAM = 'upstream'
+
+registry = MetricsRegistry()
+registry.histogram('http_request_duration_seconds', 'Duration of the API requests.')
+registry.histogram('http_request_upstream_calls', 'Number of upstream calls per API request.', CALL_BUCKETS)
+registry.histogram('http_request_upstream_seconds', 'Time spent in upstream calls per API request.')
+registry.histogram('http_request_marshal_seconds', 'Time spent marshalling per API request.')
+registry.histogram('tmdb_request_duration_seconds', 'Duration of the upstream calls to The Movie Database.')
+registry.counter('tmdb_lookups_total', 'Upstream lookups by cache status.')
+
+_trace: contextvars.ContextVar = contextvars.ContextVar('request_trace', default=None)
+
+_ID = re.compile(r'/\d+')
+
+
+def upstream_route(path: str) -> str:
+    """
+    Get the route of an upstream path with the identifiers left out, e.g. `movie/{id}/credits`.
+    """
+    return _ID.sub('/{id}', '/' + path.strip('/'))[1:]
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+def record_upstream(path: str, method: str, status: int, duration: float):
+    """
+    Record an upstream call that went over the network.
+    """
+    route = upstream_route(path)
+    registry.observe('tmdb_request_duration_seconds', duration, path=route, method=method, status=str(status))
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_upstream(route, duration, UPSTREAM)
+
+
+def record_lookup(path: str, cache: str, duration: float = 0.0):
+    """
+    Record how an upstream lookup was answered, one of `HIT`, `STALE`, `COALESCED`, `MISS` or `BYPASS`.
+    """
+    route = upstream_route(path)
+    registry.inc('tmdb_lookups_total', path=route, cache=cache)
+    trace = _trace.get()
+    # Misses and bypasses are traced by the upstream call itself.
+    if trace is not None and cache in (HIT, STALE, COALESCED):
+        trace.add_upstream(route, duration, cache)
+
+
+def record_marshal(duration: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_marshal(duration)
+
+
+def init_app(app: Flask):
+    """
+    Trace every API request, record its metrics and expose them at `/metrics`. When `SERVER_TIMING` is enabled the
+    breakdown of every response is added as a `Server-Timing` header.
+
+    :param app: The Flask application instance.
+    """
+
+    @app.before_request
+    def start_trace():
+        g.trace_token = _trace.set(RequestTrace())
+
+    @app.after_request
+    def finish_trace(response: Response) -> Response:
+        trace = _trace.get()
+        if trace is None or request.url_rule is None or request.url_rule.endpoint == 'metrics':
+            return response
+        total = time.perf_counter() - trace.started
+        upstream = sum(duration for _, duration, _ in trace.upstream)
+        route = request.url_rule.rule
+        registry.observe('http_request_duration_seconds', total, route=route, method=request.method,
+                         status=str(response.status_code))
+        registry.observe('http_request_upstream_calls', trace.calls, route=route)
+        registry.observe('http_request_upstream_seconds', upstream, route=route)
+        registry.observe('http_request_marshal_seconds', trace.marshal, route=route)
+
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = ', '.join([
+                f'upstream;dur={upstream * 1000:.1f};desc="{trace.calls} calls, {trace.cached} cached"',
+                f'marshal;dur={trace.marshal * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ])
+        return response
+
+    @app.teardown_request
+    def reset_trace(_):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            _trace.reset(token)
+
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
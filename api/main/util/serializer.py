@@ -0,0 +1,160 @@
+"""
+Compiled serializers for the flask-restx models.
+
+`marshal` walks every field of every object through the `fields.*` classes. `serializer` instead generates a single
+function per model that builds the output dict directly, with the exact same result as `flask_restx.marshal` (key
+order, `None` for missing keys, the formatting of every field type). Values the generated code doesn't expect, e.g.
+a nested object that is missing, make it fall back to `marshal` for that object, so the output and the errors raised
+are always those of flask-restx.
+"""
+import threading
+from typing import Any, Callable, Dict
+
+from flask_restx import fields, marshal
+from flask_restx.inputs import boolean
+
+Serializer = Callable[[Any], Any]
+
+# Field types whose `format` is inlined, by the expression formatting a non-null value `v`.
+SCALARS = {
+    fields.Raw: '{v}',
+    fields.String: 'str({v})',
+    fields.Integer: 'int({v})',
+    fields.Float: 'float({v})',
+    fields.Boolean: 'boolean({v})',
+}
+
+_compiled: Dict[int, Serializer] = {}
+# Reentrant since compiling a model compiles its nested models.
+_lock = threading.RLock()
+
+
+class Unsupported(Exception):
+    """
+    Raised by the generated code for values it doesn't handle, to fall back to `marshal`.
+    """
+
+
+def _unsupported():
+    raise Unsupported
+
+
+def _plain(field: fields.Raw) -> bool:
+    """
+    Whether the field only reads its own key and has no default or mask.
+    """
+    return field.attribute is None and field.default is None and field.mask is None
+
+
+def _scalar(field: fields.Raw, v: str) -> str:
+    """
+    Get the expression formatting the value `v` of a scalar field, None if the field isn't an inlined scalar.
+    """
+    template = SCALARS.get(type(field))
+    return template.format(v=v) if template is not None and _plain(field) else None
+
+
+class _Compiler:
+    """
+    Generates the source of the serializer of a model and of all nested models.
+    """
+
+    def __init__(self):
+        self.namespace = {'boolean': boolean, '_unsupported': _unsupported}
+
+    def reference(self, value: Any) -> str:
+        name = f'_ref{len(self.namespace)}'
+        self.namespace[name] = value
+        return name
+
+    def nested(self, model, value: str) -> str:
+        """
+        Get the expression serializing the nested model for the value named `value`.
+        """
+        return f'{self.reference(serializer(model))}({value})'
+
+    def field(self, key: str, field: fields.Raw) -> str:
+        """
+        Get the expression of the value of a field, with `obj` the serialized dict and `get` its `get` method.
+        """
+        # Keys that are attributes of dict are read with getattr by flask-restx when missing.
+        if hasattr(dict, key):
+            return f'{self.reference(field)}.output({key!r}, obj)'
+        get = f'get({key!r})'
+        scalar = _scalar(field, 'v')
+        if scalar is not None:
+            return f'None if (v := {get}) is None else {scalar}'
+        if type(field) is fields.List and _plain(field):
+            container = field.container
+            item = _scalar(container, 'x')
+            if item is not None:
+                item = f'None if x is None else {item}'
+            elif type(container) is fields.Nested and _plain(container) and not container.skip_none:
+                item = f'{self.nested(container.nested, "x")} if type(x) is dict else _unsupported()'
+            if item is not None:
+                return (f'None if (v := {get}) is None else '
+                        f'[{item} for x in v] if type(v) is list or type(v) is tuple else _unsupported()')
+        if type(field) is fields.Nested and _plain(field) and not field.skip_none:
+            return f'{self.nested(field.nested, "v")} if type(v := {get}) is dict else _unsupported()'
+        return f'{self.reference(field)}.output({key!r}, obj)'
+
+    def compile(self, model) -> Callable[[dict], dict]:
+        model = getattr(model, 'resolved', model)
+        body = ',\n'.join(f'        {key!r}: {self.field(key, field)}' for key, field in model.items())
+        source = f'def serialize(obj):\n    get = obj.get\n    return {{\n{body}\n    }}\n'
+        exec(compile(source, f'<serializer {getattr(model, "name", "model")}>', 'exec'), self.namespace)
+        return self.namespace['serialize']
+
+
+def _compilable(model) -> bool:
+    if getattr(model, '__mask__', None):
+        return False
+    return not any(isinstance(field, (fields.Wildcard, dict)) or not isinstance(field, fields.Raw)
+                   for field in getattr(model, 'resolved', model).values())
+
+
+def serializer(model) -> Serializer:
+    """
+    Get the compiled serializer of a model, it serializes a single object or a list of objects like
+    `marshal(data, model)`.
+
+    :param model: The model, a `Model` or a dict of fields.
+    :return: The serializer.
+    """
+    compiled = _compiled.get(id(model))
+    if compiled is not None:
+        return compiled
+
+    with _lock:
+        if id(model) in _compiled:
+            return _compiled[id(model)]
+        build = _Compiler().compile(model) if _compilable(model) else None
+
+        def serialize(data: Any) -> Any:
+            if type(data) is dict and build is not None:
+                try:
+                    return build(data)
+                except Exception:
+                    # Reproduce the result, or the error, of flask-restx.
+                    pass
+            elif type(data) is list or type(data) is tuple:
+                return [serialize(item) for item in data]
+            return marshal(data, model)
+
+        # Keep the model alive, the cache is keyed by its id.
+        serialize.model = model
+        _compiled[id(model)] = serialize
+        return serialize
+
+
+def serialize(data: Any, model, envelope: str = None) -> Any:
+    """
+    Serialize data with a model, the result is identical to `marshal(data, model, envelope)`.
+
+    :param data: The object or list of objects.
+    :param model: The model.
+    :param envelope: Optional key enveloping the result.
+    :return: The serialized data.
+    """
+    out = serializer(model)(data)
+    return {envelope: out} if envelope else out
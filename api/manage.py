@@ -1,3 +1,4 @@
+import math
 import os
 import sys
 
@@ -9,6 +10,8 @@ from main import create_app
 from main.controller.movie_controller import ns as movie_ns
 from main.controller.auth_controller import ns as auth_ns
 from main.controller.account_controller import ns as acc_ns
+from main.service.governor import Throttled
+from main.service.tmdb_async import UPSTREAM_ERRORS
 
 blueprint = Blueprint('api', __name__)
 
@@ -38,14 +41,36 @@ class MoviesAPI:
         self.api.add_namespace(auth_ns, path='/authentication')
         self.api.add_namespace(acc_ns, path='/account')
 
+        @self.api.errorhandler(Throttled)
+        def handle_throttled(error: Throttled):
+            """The rate limit of The Movie Database is used up, the client may try again after `Retry-After` seconds."""
+            return ({'message': 'The Movie Database is busy, try again later.'}, 503,
+                    {'Retry-After': str(math.ceil(error.retry_after))})
+
+        def handle_unreachable(error: Exception):
+            """The Movie Database can't be reached and nothing is mirrored to fall back on."""
+            return {'message': 'The Movie Database is unavailable, try again later.'}, 502
+
+        # Registered after `Throttled`, the first matching handler is used.
+        for error in UPSTREAM_ERRORS:
+            self.api.errorhandler(error)(handle_unreachable)
+
     @staticmethod
     def run():
-        """Run the Flask application"""
+        """Run the Flask application, `python manage.py <prod|dev> [wsgi|asgi]`. In 'asgi' mode the application is
+        served by uvicorn through a2wsgi instead of the Flask development server, still a thread per request.
+
+        `python manage.py <prod|dev> sync [pages]` bulk loads the mirror offline instead: the given number of popular
+        pages and the details of their movies are synced once, the indexes of the workers load them on start.
+
+        `python manage.py <prod|dev> warmup [movies]` warms the caches before a deploy instead, see `Warmup`."""
         mode = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] and sys.argv[1] in [
             'prod', 'dev'] else 'dev'
 
-        # Create Flask application instance
-        app = create_app(mode)
+        command = sys.argv[2] if len(sys.argv) > 2 else None
+
+        # Create Flask application instance, the one-off commands don't start the background jobs
+        app = create_app(mode, background=command not in ['sync', 'warmup'])
 
         # Register blueprint with Flask application
         app.register_blueprint(blueprint)
@@ -56,8 +81,38 @@ class MoviesAPI:
         # Get port number from environment variables or use default 5000
         port = int(os.environ.get("PORT", 5000))
 
-        # Run the Flask application
-        app.run(host='0.0.0.0', port=port)
+        if command == 'sync':
+            from main.service.mirror_service import mirror, mirror_sync
+
+            if len(sys.argv) > 3:
+                mirror_sync.pages = int(sys.argv[3])
+            print(mirror_sync.sweep(), mirror.stats())
+            return
+
+        if command == 'warmup':
+            from main.service.warmup import warmup
+
+            if len(sys.argv) > 3:
+                warmup.movies = int(sys.argv[3])
+            warmup.run(lambda progress: print(
+                f"\r{progress['step']}: {progress['done'] + progress['failed']}/{progress['total']} tasks, "
+                f"{progress['failed']} failed, {progress['duration']:.1f}s", end='', flush=True))
+            print()
+            return
+
+        # Get server from the arguments or the configuration
+        server = command if command in ['wsgi', 'asgi'] else app.config['SERVER']
+
+        if server == 'asgi':
+            # Serve the WSGI application under an ASGI server through a2wsgi. Every request still holds a thread of the
+            # pool while it runs, so ASGI_THREADS caps the concurrent requests as in WSGI mode.
+            import uvicorn
+            from a2wsgi import WSGIMiddleware
+
+            uvicorn.run(WSGIMiddleware(app, workers=app.config['ASGI_THREADS']), host='0.0.0.0', port=port)
+        else:
+            # Run the Flask application
+            app.run(host='0.0.0.0', port=port)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from main.service.governor import LocalBucket, governor
+from main.service.tmdb_service import TMDBClient
+
+
+def response(status: int, headers: dict = None) -> requests.Response:
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    return result
+
+
+class RetryAfterTest(unittest.TestCase):
+    """
+    An upstream `Retry-After` is waited out before the call is retried, by the governor or by the call itself.
+    """
+
+    def setUp(self):
+        self.client = TMDBClient()
+        self.client.backoff_factor = 0.3
+        self.bucket = governor.bucket
+        self.addCleanup(setattr, governor, 'bucket', self.bucket)
+
+    def request(self):
+        """
+        Request a path that is rate limited once, without actually sleeping.
+
+        :return: The delays slept between the attempts.
+        """
+        with mock.patch.object(self.client.session, 'request',
+                               side_effect=[response(429, {'Retry-After': '2'}), response(200)]), \
+                mock.patch('main.service.tmdb_service.time.sleep') as sleep:
+            self.assertEqual(self.client.get('movie/550').status_code, 200)
+        return [call.args[0] for call in sleep.call_args_list]
+
+    def test_disabled_rate_limit_sleeps_retry_after(self):
+        governor.bucket = None
+        self.assertEqual(self.request(), [2.0])
+
+    def test_rate_limit_blocks_the_bucket(self):
+        governor.bucket = LocalBucket(1000, 1000)
+        with mock.patch.object(governor.bucket, 'block') as block:
+            self.assertEqual(self.request(), [0.0])
+        block.assert_called_once_with(2.0)
+
+    def test_no_retry_after_backs_off(self):
+        governor.bucket = None
+        with mock.patch.object(self.client.session, 'request', side_effect=[response(503), response(200)]), \
+                mock.patch('main.service.tmdb_service.time.sleep') as sleep:
+            self.assertEqual(self.client.get('movie/550').status_code, 200)
+        sleep.assert_called_once_with(0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()